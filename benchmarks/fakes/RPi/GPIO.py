@@ -0,0 +1,45 @@
+"""Stand-in for the RPi.GPIO module, without any pins.
+"""
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+LOW = 0
+HIGH = 1
+PUD_UP = 22
+FALLING = 32
+
+_mode = None
+
+
+def getmode():
+    return _mode
+
+
+def setmode(mode):
+    global _mode
+    _mode = mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=None):
+    pass
+
+
+def output(channel, value):
+    pass
+
+
+def add_event_detect(channel, edge, callback=None, bouncetime=None):
+    pass
+
+
+def remove_event_detect(channel):
+    pass
+
+
+def cleanup(channel=None):
+    pass
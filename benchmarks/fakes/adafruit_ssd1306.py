@@ -0,0 +1,107 @@
+"""Stand-in for the adafruit_ssd1306 driver.
+
+It writes the same bytes to the bus as the real driver, from the
+initialization sequence to the frames, and converts images with the
+same pixel-by-pixel loop, so the time spent in the driver is
+representative too.
+"""
+SET_DISP = 0xAE
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+# The commands the real driver (2.x, before SET_IREF_SELECT was added)
+# sends to initialize a 128x64 display with an internal supply
+INIT_COMMANDS = (
+    SET_DISP,           # off
+    0x20, 0x00,         # horizontal addressing
+    0x40,               # start line 0
+    0xA1,               # column 127 mapped to SEG0
+    0xA8, 0x3F,         # multiplex ratio: 64 rows
+    0xC8,               # scan from COM[N] to COM0
+    0xD3, 0x00,         # no display offset
+    0xDA, 0x12,         # alternative COM pin configuration
+    0xD5, 0x80,         # clock divide ratio and oscillator frequency
+    0xD9, 0xF1,         # precharge period
+    0xDB, 0x30,         # VCOM deselect level
+    0x81, 0xFF,         # contrast
+    0xA4,               # show the display RAM
+    0xA6,               # not inverted
+    0x8D, 0x14,         # enable the charge pump
+    SET_DISP | 0x01,    # on
+)
+
+
+class I2CDevice:
+    def __init__(self, i2c, device_address):
+        self.i2c = i2c
+        self.device_address = device_address
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def write(self, buf, *, start=0, end=None):
+        self.i2c.writeto(self.device_address, buf, start=start, end=end)
+
+
+class SSD1306_I2C:
+    def __init__(self, width, height, i2c, *, addr=0x3C, external_vcc=False,
+                 reset=None, page_addressing=False):
+        self.width = width
+        self.height = height
+        self.pages = height // 8
+        self.i2c_device = I2CDevice(i2c, addr)
+        self.temp = bytearray(2)
+        self.buffer = bytearray(self.pages * width + 1)
+        self.buffer[0] = 0x40
+        self.buf = memoryview(self.buffer)[1:]
+        self.poweron()
+        for cmd in INIT_COMMANDS:
+            self.write_cmd(cmd)
+        self.fill(0)
+        self.show()
+
+    def write_cmd(self, cmd):
+        self.temp[0] = 0x80
+        self.temp[1] = cmd
+        with self.i2c_device:
+            self.i2c_device.write(self.temp)
+
+    def poweroff(self):
+        self.write_cmd(SET_DISP)
+
+    def poweron(self):
+        self.write_cmd(SET_DISP | 0x01)
+
+    def fill(self, color):
+        fill = 0xFF if color else 0x00
+        for i in range(len(self.buf)):
+            self.buf[i] = fill
+
+    def pixel(self, x, y, color):
+        index = (y >> 3) * self.width + x
+        offset = y & 0x07
+        self.buf[index] = (self.buf[index] & ~(0x01 << offset)) | (
+            (color != 0) << offset)
+
+    def image(self, img):
+        if img.mode != "1":
+            raise ValueError("Image must be in mode 1.")
+        if img.size != (self.width, self.height):
+            raise ValueError("Image must be same dimensions as display.")
+        pixels = img.load()
+        for i in range(len(self.buf)):
+            self.buf[i] = 0
+        for x in range(self.width):
+            for y in range(self.height):
+                if pixels[(x, y)]:
+                    self.pixel(x, y, 1)
+
+    def show(self):
+        for cmd in (SET_COL_ADDR, 0, self.width - 1,
+                    SET_PAGE_ADDR, 0, self.pages - 1):
+            self.write_cmd(cmd)
+        with self.i2c_device:
+            self.i2c_device.write(self.buffer)
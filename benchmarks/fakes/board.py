@@ -0,0 +1,4 @@
+"""Stand-in for the CircuitPython `board` module.
+"""
+SCL = 3
+SDA = 2
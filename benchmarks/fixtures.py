@@ -0,0 +1,165 @@
+"""Stand-ins for the parts of OctoPrint the plugin talks to.
+"""
+import copy
+import logging
+
+
+class FakeSettings:
+    """Plugin settings, backed by a dict on top of the plugin defaults.
+    """
+    def __init__(self, defaults, **overrides):
+        self.data = dict(defaults, **overrides)
+
+    def get(self, path, merged=False):
+        return self.data.get(path[0])
+
+    def get_int(self, path, merged=False):
+        value = self.data.get(path[0])
+        return None if value is None else int(value)
+
+    def get_float(self, path, merged=False):
+        value = self.data.get(path[0])
+        return None if value is None else float(value)
+
+    def get_boolean(self, path, merged=False):
+        return bool(self.data.get(path[0]))
+
+    def get_all_data(self, **kwargs):
+        return dict(self.data)
+
+    def set(self, path, value):
+        self.data[path[0]] = value
+
+
+# A printer state as returned by OctoPrint's PrinterInterface while
+# printing a file uploaded through the web UI.
+PRINTING_DATA = {
+    'state': {
+        'text': 'Printing',
+        'flags': {
+            'operational': True, 'printing': True, 'cancelling': False,
+            'pausing': False, 'resuming': False, 'finishing': False,
+            'closedOrError': False, 'error': False, 'paused': False,
+            'ready': False, 'sdReady': False,
+        },
+        'error': '',
+    },
+    'job': {
+        'file': {
+            'name': '3DBenchy_0.2mm_PLA_MK3S_1h22m.gcode',
+            'path': '3DBenchy_0.2mm_PLA_MK3S_1h22m.gcode',
+            'display': '3DBenchy_0.2mm_PLA_MK3S_1h22m.gcode',
+            'origin': 'local',
+            'size': 4287514,
+            'date': 1642982400,
+        },
+        'estimatedPrintTime': 4920.5,
+        'averagePrintTime': None,
+        'lastPrintTime': None,
+        'filament': {'tool0': {'length': 4215.37, 'volume': 10.14}},
+        'user': 'admin',
+    },
+    'currentZ': 12.4,
+    'progress': {
+        'completion': 37.42,
+        'filepos': 1604408,
+        'printTime': 1841,
+        'printTimeLeft': 3079,
+        'printTimeLeftOrigin': 'linear',
+    },
+    'offsets': {},
+    'resends': {'count': 0, 'transmitted': 51873, 'ratio': 0},
+}
+
+TEMPERATURES = {
+    'tool0': {'actual': 214.8, 'target': 215.0, 'offset': 0},
+    'bed': {'actual': 59.9, 'target': 60.0, 'offset': 0},
+    'chamber': {'actual': None, 'target': None, 'offset': 0},
+}
+
+
+class FakePrinter:
+    """A printer in the middle of a print.
+
+    Each call to `advance()` moves the print on by one second, so the
+    screens have something new to draw.
+
+    """
+    def __init__(self):
+        self.data = copy.deepcopy(PRINTING_DATA)
+        self.calls = 0
+
+    def advance(self):
+        progress = self.data['progress']
+        progress['printTime'] += 1
+        progress['printTimeLeft'] = max(progress['printTimeLeft'] - 1, 0)
+        progress['completion'] = min(progress['completion'] + 0.02, 100)
+        progress['filepos'] += 871
+
+    def get_current_data(self):
+        self.calls += 1
+        return copy.deepcopy(self.data)
+
+    def get_current_temperatures(self):
+        self.calls += 1
+        return copy.deepcopy(TEMPERATURES)
+
+    def get_current_connection(self):
+        self.calls += 1
+        return ('Printing', '/dev/ttyACM0', 115200, {'id': '_default'})
+
+    def get_state_string(self):
+        self.calls += 1
+        return self.data['state']['text']
+
+    def is_printing(self):
+        self.calls += 1
+        return self.data['state']['flags']['printing']
+
+    def is_paused(self):
+        self.calls += 1
+        return self.data['state']['flags']['paused']
+
+    def is_ready(self):
+        self.calls += 1
+        return self.data['state']['flags']['ready']
+
+    def cancel_print(self):
+        pass
+
+
+class FakePluginManager:
+    """Collects the plugin messages sent to the web UI.
+    """
+    def __init__(self):
+        self.messages = 0
+
+    def send_plugin_message(self, identifier, data):
+        self.messages += 1
+
+    def get_hooks(self, name):
+        return {}
+
+
+def make_plugin(**settings):
+    """Create the plugin with its display and screens set up, but
+    without starting any of its threads.
+    """
+    import octoprint_display_panel
+
+    plugin = octoprint_display_panel.Display_panelPlugin()
+    plugin._settings = FakeSettings(plugin.get_settings_defaults(), **settings)
+    plugin._printer = FakePrinter()
+    plugin._plugin_manager = FakePluginManager()
+    plugin._logger = logging.getLogger('octoprint.plugins.display_panel')
+    plugin._identifier = 'display_panel'
+    plugin._plugin_version = 'benchmark'
+    plugin.initialize()
+    plugin.setup_display()
+    plugin.setup_screens()
+
+    # Sample the system stats once, instead of on a background thread
+    sampler = plugin.top_screen.screens['system'].sampler
+    sampler.stop()
+    sampler.sample()
+    return plugin
@@ -0,0 +1,358 @@
+"""Offline benchmarks for the Micro Panel render and display pipeline.
+
+Runs without a Raspberry Pi: the display driver, I2C bus and GPIO
+modules are replaced by the stand-ins in `fakes/`, and the printer by
+the one in `fixtures.py`. Each scenario is timed, its memory
+allocations traced and the bytes it writes to the I2C bus counted.
+
+    python benchmarks/run.py              # run and compare to baseline
+    python benchmarks/run.py --save       # run and store a new baseline
+    python benchmarks/run.py -k screen    # only run matching scenarios
+
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, 'fakes'))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import PIL  # noqa: E402
+
+from fixtures import make_plugin  # noqa: E402
+from octoprint_display_panel import panels, screens  # noqa: E402
+from octoprint_display_panel.panels import i2c_dev, micro_panel  # noqa: E402
+from octoprint_display_panel.panels import spi_dev, spi_panel  # noqa: E402
+from octoprint_display_panel.panels import virtual_panel  # noqa: E402
+
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+# Files standing in for /dev/i2c-1 and /dev/spidev0.0 in the scenarios
+# using the direct I2C transport or the SPI panel. The panels only write
+# to files through the fake devices, which are set up by the backends
+# registered below.
+FAKE_I2C_DEVICE = os.path.join(tempfile.gettempdir(),
+                               'display_panel-benchmark-i2c')
+FAKE_SPI_DEVICE = os.path.join(tempfile.gettempdir(),
+                               'display_panel-benchmark-spi')
+
+# Iterations run before measuring, to fill caches
+WARMUP = 5
+
+SCENARIOS = {}
+
+
+class FakeI2CDevPanel(micro_panel.MicroPanel):
+    """A Micro Panel on the direct I2C transport, writing to a file.
+    """
+    def open_bus(self, settings):
+        return i2c_dev.FakeI2CDev(FAKE_I2C_DEVICE)
+
+
+class FakeSPIPanel(spi_panel.SPIPanel):
+    """An SPI panel recording its transfers to a file.
+    """
+    def open_bus(self, settings):
+        return spi_dev.FakeSPIDev(FAKE_SPI_DEVICE, dc=self.set_dc)
+
+
+panels.register_backend('fake_i2c_dev',
+                        lambda width, height, button_callback:
+                        FakeI2CDevPanel(button_callback))
+panels.register_backend('fake_spi_panel',
+                        lambda width, height, button_callback:
+                        FakeSPIPanel(button_callback))
+
+
+def scenario(name, **settings):
+    """Register a scenario.
+
+    A scenario is a function that takes the plugin and returns the
+    operation to measure. The plugin is set up with the given settings
+    on top of the defaults.
+
+    """
+    def register(setup):
+        SCENARIOS[name] = (setup, settings)
+        return setup
+    return register
+
+
+def draw_screen(plugin, screen):
+    """Return an operation that redraws a screen with fresh printer data.
+    """
+    helper = plugin.top_screen._printer
+
+    def op():
+        plugin._printer.advance()
+        screen.invalidate()
+        with helper.snapshot():
+            screen.image
+    return op
+
+
+@scenario('screen.system')
+def system_screen(plugin):
+    return draw_screen(plugin, plugin.top_screen.screens['system'])
+
+
+@scenario('screen.printer')
+def printer_screen(plugin):
+    return draw_screen(plugin, plugin.top_screen.screens['printer'])
+
+
+@scenario('screen.print_status')
+def print_status_screen(plugin):
+    return draw_screen(plugin, plugin.top_screen.screens['print'])
+
+
+@scenario('screen.status_bar')
+def status_bar_screen(plugin):
+    return draw_screen(plugin, plugin.top_screen.status_bar_screen)
+
+
+@scenario('screen.cancel')
+def cancel_screen(plugin):
+    top = plugin.top_screen
+    screen = screens.printer.JobCancelScreen(top.width, top.subscreen_height,
+                                             top._printer)
+    screen.timer.cancel()
+    return draw_screen(plugin, screen)
+
+
+@scenario('top.compose')
+def top_compose(plugin):
+    top = plugin.top_screen
+
+    def op():
+        plugin._printer.advance()
+        top.invalidate()
+        top.image
+    return op
+
+
+@scenario('top.cached')
+def top_cached(plugin):
+    top = plugin.top_screen
+
+    def op():
+        top.image
+    return op
+
+
+@scenario('panel.image')
+def panel_image(plugin):
+    frame = plugin.top_screen.image.copy()
+    panel = find_panel(plugin)
+
+    def op():
+        panel.image(frame)
+    return op
+
+
+def show_full_frame(plugin):
+    """Return an operation that sends a full frame to the Micro Panel.
+    """
+    panel = find_panel(plugin)
+    panel.image(plugin.top_screen.image)
+
+    def op():
+        panel._last_frame = None
+        panel.show()
+    return op
+
+
+@scenario('panel.show_full')
+def show_full(plugin):
+    return show_full_frame(plugin)
+
+
+@scenario('panel.show_full_i2c_dev', panel_backends=['fake_i2c_dev'])
+def show_full_i2c_dev(plugin):
+    return show_full_frame(plugin)
+
+
+@scenario('panel.show_full_spi', panel_backends=['fake_spi_panel'])
+def show_full_spi(plugin):
+    return show_full_frame(plugin)
+
+
+@scenario('panel.image_spi', panel_backends=['fake_spi_panel'])
+def panel_image_spi(plugin):
+    return panel_image(plugin)
+
+
+@scenario('pipeline.render_ui')
+def render_ui(plugin):
+    # The time left on the print status screen changes every second
+    plugin.top_screen.set_subscreen('print')
+
+    def op():
+        plugin._printer.advance()
+        plugin.top_screen.invalidate()
+        plugin.render_ui()
+    return op
+
+
+@scenario('pipeline.render_ui_unchanged')
+def render_ui_unchanged(plugin):
+    def op():
+        plugin.top_screen.invalidate()
+        plugin.render_ui()
+    return op
+
+
+@scenario('virtual.encode_png')
+def encode_png(plugin):
+    frame = plugin.top_screen.image.copy()
+    return lambda: virtual_panel.encode_png(frame)
+
+
+@scenario('virtual.encode_raw')
+def encode_raw(plugin):
+    frame = plugin.top_screen.image.copy()
+    return lambda: virtual_panel.encode_raw(frame)
+
+
+def find_panel(plugin):
+    """Return the Micro Panel, whose I2C or SPI bus is a fake.
+    """
+    for panel in plugin.disp.panels:
+        if hasattr(panel, 'i2c') or hasattr(panel, 'spi'):
+            return panel
+    raise RuntimeError('no Micro Panel was set up')
+
+
+def find_bus(panel):
+    return panel.spi if hasattr(panel, 'spi') else panel.i2c
+
+
+def measure(op, bus, iterations):
+    """Run an operation repeatedly and return its costs per iteration.
+    """
+    for _ in range(WARMUP):
+        op()
+
+    bytes_written, transactions = bus.bytes_written, bus.transactions
+    times = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        op()
+        times.append(time.perf_counter() - started)
+    bytes_written = bus.bytes_written - bytes_written
+    transactions = bus.transactions - transactions
+
+    # Allocations are traced in a separate pass, as tracing slows
+    # everything down.
+    allocated = []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            in_use = tracemalloc.get_traced_memory()[0]
+            op()
+            allocated.append(tracemalloc.get_traced_memory()[1] - in_use)
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        'mean_us': round(statistics.mean(times) * 1e6, 1),
+        'median_us': round(statistics.median(times) * 1e6, 1),
+        'p95_us': round(times[int(len(times) * 0.95) - 1] * 1e6, 1),
+        'alloc_bytes': int(statistics.median(allocated)),
+        'bus_bytes': round(bytes_written / iterations, 1),
+        'bus_writes': round(transactions / iterations, 1),
+    }
+
+
+def run(names, iterations):
+    results = {}
+    for name in names:
+        setup, settings = SCENARIOS[name]
+        plugin = make_plugin(virtual_panel=True, **settings)
+        op = setup(plugin)
+        bus = find_bus(find_panel(plugin))
+        results[name] = measure(op, bus, iterations)
+        plugin.disp.shutdown()
+        bus.deinit()
+    return results
+
+
+def change(old, new):
+    if not old:
+        return '' if not new else '   new'
+    return f'{(new - old) / old * 100:+6.1f}%'
+
+
+def report(results, baseline, threshold):
+    """Print the results next to the baseline, and return the names of
+    the scenarios that got slower by more than `threshold` percent.
+    """
+    base = baseline.get('results', {}) if baseline else {}
+    regressions = []
+    print(f'{"scenario":30} {"median us":>10} {"":>7} {"alloc B":>9} {"":>7}'
+          f' {"bus B":>8} {"":>7}')
+    for name, result in results.items():
+        old = base.get(name, {})
+        print(f'{name:30}'
+              f' {result["median_us"]:10.1f} {change(old.get("median_us"), result["median_us"]):>7}'
+              f' {result["alloc_bytes"]:9d} {change(old.get("alloc_bytes"), result["alloc_bytes"]):>7}'
+              f' {result["bus_bytes"]:8.1f} {change(old.get("bus_bytes"), result["bus_bytes"]):>7}')
+        if (threshold is not None and old.get('median_us')
+                and result['median_us'] > old['median_us'] * (1 + threshold / 100)):
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-k', dest='pattern', default='',
+                        help='only run scenarios whose name contains this')
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--baseline', default=BASELINE,
+                        help='baseline file to compare with or save to')
+    parser.add_argument('--threshold', type=float,
+                        help='exit with an error if any scenario is this '
+                             'many percent slower than the baseline')
+    args = parser.parse_args()
+
+    names = [name for name in SCENARIOS if args.pattern in name]
+    results = run(names, args.iterations)
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = report(results, baseline, args.threshold)
+
+    if args.save:
+        # Scenarios that were not run keep their baseline results
+        if baseline:
+            results = dict(baseline['results'], **results)
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'machine': platform.machine(),
+                'iterations': args.iterations,
+                'results': results,
+            }, f, indent=1, sort_keys=True)
+            f.write('\n')
+
+    if regressions:
+        print(f'Slower than the baseline: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
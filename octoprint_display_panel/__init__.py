@@ -6,18 +6,23 @@ import psutil
 import shutil
 import socket
 
+import base64
 import json
 
+import flask
 import octoprint.plugin
 from octoprint.events import eventManager, Events
 from octoprint.util import RepeatedTimer, ResettableTimer
 import time
+import threading
 from enum import Enum
 from PIL import Image, ImageDraw, ImageFont
 import inspect
 
 from . import panels
+from .metrics import METRICS
 from .panels.virtual_panel import VirtualPanelMixin
+from .render import RenderWorker
 
 
 from . import screens
@@ -44,9 +49,13 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
                           VirtualPanelMixin):
 
 	_display_init = False
+	_event_routes = {}
+	_event_routes_version = None
+	_last_frame = None
+	_metrics_timer = None
+	_render_worker = None
 	_etl_format = "{hours:02d}h {minutes:02d}m {seconds:02d}s"
 	_eta_strftime = ""
-	_image_rotate = False
 	_printer_state = 0	# 0 - disconnected, 1 - connected but idle, 2 - printing
 	_progress_on_top = False
 	_screen_mode = ScreenModes.SYSTEM
@@ -63,7 +72,9 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		self.setup_screens()
 		self.clear_display()
 		self.check_system_stats()
-		self.start_system_timer()
+		self.start_render_worker()
+		self.start_output_workers()
+		self.start_metrics()
 		self.update_ui()
 
 	##~~ ShutdownPlugin mixin
@@ -73,8 +84,30 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		ShutdownPlugin lifecycle hook, called before Octoprint shuts down
 		"""
 
+		if self._render_worker:
+			self._render_worker.stop()
+		if self._metrics_timer is not None:
+			self._metrics_timer.cancel()
+		if hasattr(self, 'top_screen'):
+			self.top_screen.set_visible(False)
+			system_screen = getattr(self.top_screen, 'screens', {}).get('system')
+			if system_screen is not None:
+				system_screen.sampler.stop()
 		self.clear_display()
 		self.shutdown_display()
+		self._logger.info("Frames rendered: %(rendered)d, pushed: %(pushed)d",
+		                  self.frame_stats)
+		self._logger.info("Events received: %(received)d, routed: %(routed)d",
+		                  self.event_stats)
+		if self._render_worker:
+			self._logger.info("Render requests: %(requests)d, coalesced: %(coalesced)d, "
+			                  "suppressed: %(suppressed)d, avoided while blank: %(avoided)d, "
+			                  "average latency: %(latency_avg).3fs",
+			                  self.render_stats)
+		if self._display_init:
+			for name, stats in self.disp.output_stats.items():
+				self._logger.info("Panel %s frames shown: %d, dropped: %d, average latency: %.3fs",
+				                  name, stats['frames'], stats['dropped'], stats['latency_avg'])
 
 	##~~ EventHandlerPlugin mixin
 
@@ -89,10 +122,17 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		
 		if not hasattr(self, 'top_screen'):
 			return
+
+		# Drop events no screen is interested in, without touching the screens
+		self._event_stats['received'] += 1
+		if event not in self.event_routes:
+			return
+		self._event_stats['routed'] += 1
 		
-		result = self.top_screen.process_event(event, payload)
+		with self._screen_lock:
+			result = self.top_screen.process_event(event, payload)
 		if 'DRAW' in result:
-			self.update_ui()
+			self.update_ui(governed=True)
 
 	##~~ ProgressPlugin mixin
 
@@ -101,6 +141,9 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		ProgressPlugin lifecycle hook, called when print progress changes, at most in 1% incremements
 		"""
 
+		if hasattr(self, 'top_screen'):
+			with self._screen_lock:
+				self.top_screen.invalidate()
 		self.update_ui()
 
 	def on_slicing_progress(self, slicer, source_location, source_path, destination_location, destination_path, progress):
@@ -118,7 +161,7 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		TemplatePlugin lifecycle hook, called to get templated settings
 		"""
 
-		c = [dict(type="settings", custom_bindings=False)]
+		c = [dict(type="settings", custom_bindings=True)]
 		if self._settings.get_boolean(['virtual_panel'], merged=True):
 			c.append(dict(type="tab", name="Micro Panel", template="display_panel_virtualpanel.jinja2", custom_bindings=False))
 		return c
@@ -131,11 +174,16 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		"""
 
 		self._display_init = False
+		self._display_lock = threading.Lock()
+		self._screen_lock = threading.RLock()
+		self._frame_stats = dict(rendered=0, pushed=0)
+		self._event_stats = dict(received=0, routed=0)
+		self._last_frame = None
 		self._eta_strftime = str(self._settings.get(["eta_strftime"]))
-		self._image_rotate = bool(self._settings.get(["image_rotate"]))
 		self._progress_on_top = bool(self._settings.get(["progress_on_top"]))
 		self._screen_mode = ScreenModes.SYSTEM
 		self._timebased_progress = bool(self._settings.get(["timebased_progress"]))
+		self.vp_register_frame_callback(self.vp_push_frame)
 
 	def get_settings_defaults(self):
 		"""
@@ -148,12 +196,31 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 			display_timeout_time	= 5,	# Default is 5 minutes
 			eta_strftime	= "%-m/%d %-I:%M%p",	# Default is month/day hour:minute + AM/PM
 			i2c_address		= "0x3c",		# Default is hex address 0x3c
+			i2c_bus			= 1,			# Default is /dev/i2c-1
+			i2c_device		= "",			# Default is the device of i2c_bus
+			i2c_frequency	= 0,			# Default is the platform's bus clock (Hz)
+			i2c_transport	= "busio",		# Default is the Blinka stack
 			image_rotate	= False,		# Default if False (no rotation)
+			event_redraw_interval	= 1,	# Default is at most 1 redraw per second for printer events
+			max_frame_rate	= 10,			# Default is 10 frames per second
+			metrics_enabled	= False,		# Default is disabled
+			metrics_log_interval	= 0,	# Default is never (minutes)
+			panel_backends	= ["micro_panel"],	# Default is the hardware panel only
 			pin_cancel		= -1,			# Default is disabled
 			pin_mode		= -1,			# Default is disabled
 			pin_pause		= -1,			# Default is disabled
 			pin_play		= -1,			# Default is disabled
 			progress_on_top	= False,		# Default is disabled
+			recording_directory	= "",		# Default is to keep recorded frames in memory only
+			recording_frames	= 256,		# Default is the last 256 frames
+			spi_bus			= 0,			# Default is /dev/spidev0.*
+			spi_chip_select	= 0,			# Default is CE0
+			spi_controller	= "ssd1306",	# Default is an SSD1306 display
+			spi_dc_pin		= 23,			# Default is GPIO 23
+			spi_device		= "",			# Default is the device of spi_bus and spi_chip_select
+			spi_frequency	= 8000000,		# Default is 8 MHz
+			spi_reset_pin	= 24,			# Default is GPIO 24
+			text_cache_size	= 128,			# Default is 128 rasterized strings
 			timebased_progress	= False,	# Default is disabled
 			virtual_panel = False, # Default is disabled
 		)
@@ -172,19 +239,70 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 			self.setup_display()
 			self.clear_display()
 			self.check_system_stats()
-			self.start_system_timer()
+			self.start_render_worker()
+			self.start_metrics()
 			self._screen_mode = ScreenModes.SYSTEM
 			self.update_ui()
 		
 
+	##~~ SimpleApiPlugin mixin
+
+	def get_api_commands(self):
+		"""
+		Add the stats and recording commands to the virtual panel's API commands
+		"""
+
+		return dict(super().get_api_commands(), stats=[], recording=[])
+
+	def on_api_command(self, command, data):
+		"""
+		Return the pipeline stats for the stats command and the recorded frames for the recording
+		command, leave the rest to the virtual panel
+		"""
+
+		if command == 'stats':
+			return flask.jsonify(self.get_stats())
+		if command == 'recording':
+			return self.get_recording(data.get('format', 'pbm'))
+		return super().on_api_command(command, data)
+
 	##~~ Helpers
 
-	def start_system_timer(self):
+	def start_render_worker(self):
 		"""
-		Function to refresh the screen periodically
+		Start the thread that renders frames requested through update_ui(), and handles button presses
 		"""
-		self._check_system_timer = RepeatedTimer(5, self.update_ui, None, None, True)
-		self._check_system_timer.start()
+		max_fps = self._settings.get_float(["max_frame_rate"], merged=True)
+		event_interval = self._settings.get_float(["event_redraw_interval"], merged=True)
+		if self._render_worker is None:
+			self._render_worker = RenderWorker(self.render_ui, max_fps, self.next_refresh,
+			                                   event_interval, self.process_button_press)
+		else:
+			self._render_worker.set_max_fps(max_fps)
+			self._render_worker.set_event_interval(event_interval)
+		self._render_worker.start()
+
+	def start_output_workers(self):
+		"""
+		Start the threads that show the rendered frames on each panel
+		"""
+
+		if self._display_init:
+			self.disp.start()
+
+	def start_metrics(self):
+		"""
+		Enable or disable the stage timing metrics, and log them periodically if configured
+		"""
+		METRICS.set_enabled(self._settings.get_boolean(["metrics_enabled"], merged=True))
+		if self._metrics_timer is not None:
+			self._metrics_timer.cancel()
+			self._metrics_timer = None
+
+		interval = self._settings.get_int(["metrics_log_interval"], merged=True)
+		if METRICS.enabled and interval and interval > 0:
+			self._metrics_timer = RepeatedTimer(interval * 60, METRICS.log_summary, daemon=True)
+			self._metrics_timer.start()
 
 	def check_system_stats(self):
 		"""
@@ -205,9 +323,11 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 			if self._display_init:
 				self.disp.setup(self._settings)
 			else:
+				self.register_panel_backends()
 				self.disp = panels.Panels(
 					self._settings,
-					self.handle_button_press
+					self.handle_button_press,
+					self.handle_display_power
 				)
 				
 			self._display_init = True
@@ -222,6 +342,19 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 			self.log_error(ex)
 			pass
 
+	def register_panel_backends(self):
+		"""
+		Add the panel backends provided by other plugins through the panel_backends hook
+		"""
+
+		hooks = self._plugin_manager.get_hooks("octoprint.plugin.display_panel.panel_backends")
+		for name, hook in hooks.items():
+			try:
+				for backend, factory in hook().items():
+					panels.register_backend(backend, factory)
+			except Exception:
+				self._logger.exception(f"Failed to get panel backends from {name}")
+
 	def shutdown_display(self):
 		"""Shut down display panels.
 		"""
@@ -231,6 +364,8 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		"""Create the top level screen.
 		"""
 		self._logger.info("Initializing screens...")
+		screens.base.TEXT_CACHE.resize(
+			self._settings.get_int(["text_cache_size"], merged=True))
 		try:
 		        self.top_screen = screens.MicroPanelScreenTop(
 			        self.width, self.height,
@@ -242,17 +377,54 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 				self.width, self.height,
 				"Failed to initialize,\ncheck OctoPrint log"
 			)
+		self.top_screen.set_visible(True)
 		
-	def handle_button_press(self, label):
+	def handle_button_press(self, label, pressed_at=None):
+		"""
+		Queue a button press with the given name (such as 'cancel' or 'play') for the render worker
+
+		Returns immediately, so the panel's button thread is ready for the next press. The press is
+		handled before any other redraw, and its frame is drawn right away. Until the worker runs, the
+		press is handled right here.
 		"""
-		Take action on a button press with the given name (such as 'cancel' or 'play')
+		if self._render_worker is not None and self._render_worker.press(label, pressed_at):
+			return
+		if self.process_button_press(label):
+			self.update_ui(immediate=True)
+
+	def process_button_press(self, label):
+		"""
+		Take action on a button press with the given name, and return whether the display needs a redraw
 		"""
 		try:
-			result = self.top_screen.process_button(label)
-			if 'DRAW' in result:
-				self.update_ui()
+			with self._screen_lock:
+				result = self.top_screen.process_button(label)
+			return 'DRAW' in result
 		except:
 			self._logger.exception(f'Pressed button {label}')
+			return False
+
+	def handle_display_power(self, on):
+		"""
+		Let the screens know whether the display is on, so they only do background work while visible,
+		and only render frames while it is. Once it is back on, exactly one fresh frame is rendered.
+		"""
+		if not on and self._render_worker is not None:
+			self._render_worker.suspend()
+
+		if hasattr(self, 'top_screen'):
+			with self._screen_lock:
+				self.top_screen.set_visible(on)
+				if on:
+					self.top_screen.invalidate()
+
+		if on:
+			# Frames posted while the display went off may have been dropped instead of shown,
+			# so the fresh frame has to be pushed even if it matches the last one posted
+			with self._display_lock:
+				self._last_frame = None
+			if self._render_worker is not None:
+				self._render_worker.resume()
 
 	def clear_display(self):
 		"""
@@ -260,8 +432,10 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		"""
 
 		if self._display_init:
-			self.disp.fill(0)
-			self.disp.show()
+			with self._display_lock:
+				self.disp.fill(0)
+				self.disp.show()
+				self._last_frame = None
 
 	def set_printer_state(self, event):
 		"""
@@ -287,25 +461,148 @@ class Display_panelPlugin(octoprint.plugin.StartupPlugin,
 		# Vestigial, should be deleted
 		pass
 
-	def update_ui(self):
+	def update_ui(self, immediate=False, governed=False):
 		"""
-		Update the on-screen UI based on the current screen mode and printer status
+		Request an update of the on-screen UI
+
+		Returns immediately; the frame is rendered on the render worker thread,
+		and bursts of requests are coalesced into a single frame. Immediate updates
+		(button presses) skip all rate limits, governed ones (printer events) are
+		limited to one frame per event redraw interval.
+		"""
+
+		if self._render_worker is not None:
+			self._render_worker.request(immediate=immediate, governed=governed)
+
+	def render_ui(self, pressed_at=None):
+		"""
+		Render the on-screen UI based on the current screen mode and printer status
+
+		pressed_at is the time of the button press this frame responds to, if any, so the panels can
+		measure how long it took to show it.
 		"""
 
-		
 		if self._display_init:
 			try:
-				self.image = self.top_screen.image
-				
-				# Display image.
-				if self._image_rotate:
-					self.disp.image(self.image.rotate(angle=180))
-				else:
-					self.disp.image(self.image)
-				self.disp.show()
+				started = METRICS.start()
+				with self._screen_lock:
+					self.image = self.top_screen.image
+				self._frame_stats['rendered'] += 1
+				METRICS.stop('plugin.render', started)
+
+				# Skip frames identical to the one already on the panels
+				frame = self.image.tobytes()
+				with self._display_lock:
+					if frame == self._last_frame:
+						METRICS.count('plugin.frames_unchanged')
+						return
+
+					# Display image. The screens draw into the same buffers
+					# every frame, so the panels get an image of their own.
+					# Each panel applies the configured rotation itself, and
+					# shows the frame on its own output worker.
+					pushing = METRICS.start()
+					self.disp.image(self.image.copy())
+					self.disp.show(pressed_at)
+					self._last_frame = frame
+					self._frame_stats['pushed'] += 1
+					METRICS.stop('plugin.push', pushing)
+					METRICS.stop('plugin.frame', started)
 			except Exception as ex:
 				self.log_error(ex)
 
+	def next_refresh(self):
+		"""
+		Return when the screens shown next need to be redrawn, so the render worker wakes up exactly then
+		"""
+
+		with self._screen_lock:
+			if not hasattr(self, 'top_screen'):
+				return None
+			return self.top_screen.next_refresh
+
+	@property
+	def event_routes(self):
+		"""
+		Index of event names to the sets of screens that process them, rebuilt whenever the screen tree changes
+		"""
+
+		if self._event_routes_version != screens.base.tree_version:
+			with self._screen_lock:
+				self._event_routes_version = screens.base.tree_version
+				self._event_routes = {
+					event: frozenset(handlers)
+					for event, handlers in self.top_screen.event_routes().items()
+				}
+		return self._event_routes
+
+	@property
+	def event_stats(self):
+		"""
+		Counters of events received vs. events routed to the screens
+		"""
+
+		return dict(self._event_stats)
+
+	@property
+	def frame_stats(self):
+		"""
+		Counters of frames rendered vs. frames actually pushed to the panels
+		"""
+
+		return dict(self._frame_stats)
+
+	@property
+	def render_stats(self):
+		"""
+		Counters of the render worker: requests, coalesced requests, queue depth and latency
+		"""
+
+		if self._render_worker is None:
+			return {}
+		return self._render_worker.get_stats()
+
+	def get_stats(self):
+		"""
+		Collect the stage timings and counters of the whole render and display pipeline
+		"""
+
+		stats = dict(
+			metrics=METRICS.summary(),
+			events=self.event_stats,
+			frames=self.frame_stats,
+			render=self.render_stats,
+			virtual_panel=self.vp_get_stats(),
+			text_cache=screens.base.TEXT_CACHE.stats,
+		)
+		if self._display_init:
+			stats['panels'] = self.disp.stats
+			stats['outputs'] = self.disp.output_stats
+		printer = getattr(getattr(self, 'top_screen', None), '_printer', None)
+		if isinstance(printer, screens.printer.PrinterHelper):
+			stats['printer'] = dict(printer.stats)
+		return stats
+
+	def get_recording(self, format):
+		"""
+		Return the frames kept in memory by the recording panel, oldest first, each base64 encoded as a
+		PBM file ('pbm') or as a packed 1-bit framebuffer ('raw')
+		"""
+
+		encode = panels.recording_panel.FRAME_ENCODERS.get(format)
+		if encode is None:
+			return flask.abort(400, f"{format} is not a valid recording format")
+		frames = self.disp.recorded_frames() if self._display_init else None
+		if frames is None:
+			return flask.abort(404, "Frame recording is not enabled")
+		return flask.jsonify(
+			format=format,
+			width=self.disp.width,
+			height=self.disp.height,
+			frames=[dict(time=timestamp, frame=base64.b64encode(encode(image)).decode('ascii'))
+			        for timestamp, image in frames],
+		)
+
 	def log_error(self, ex):
 		"""
 		Helper function for more complete logging on exceptions
@@ -0,0 +1,131 @@
+"""Timing instrumentation for the render and display pipeline.
+
+Hot paths measure their stages like this:
+
+    started = METRICS.start()
+    ...
+    METRICS.stop('stage', started)
+
+While metrics are disabled, `start()` returns None and `stop()`
+returns right away, so the instrumentation costs next to nothing.
+
+"""
+import threading
+from collections import deque
+from octoprint.util import monotonic_time
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.metrics")
+
+
+class RollingHistogram:
+    """Keeps the most recent samples of a value for percentiles, along
+    with totals over all samples.
+    """
+    def __init__(self, size=256):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def summary(self):
+        """Return the count and mean over all samples, and the p50, p95
+        and max of the recent ones.
+        """
+        samples = sorted(self.samples)
+        if not samples:
+            return {'count': 0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'p50': samples[len(samples) // 2],
+            'p95': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+            'max': samples[-1],
+            'max_all': self.max,
+        }
+
+
+class Metrics:
+    """Per-stage timing histograms and counters.
+    """
+    def __init__(self, enabled=False, size=256):
+        self.enabled = enabled
+        self.size = size
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Discard everything recorded so far.
+        """
+        with self._lock:
+            self.histograms = {}
+            self.counters = {}
+
+    def set_enabled(self, enabled):
+        self.enabled = bool(enabled)
+
+    def start(self):
+        """Return the start time of a stage, or None while disabled.
+        """
+        return monotonic_time() if self.enabled else None
+
+    def stop(self, stage, started):
+        """Record the time taken by a stage since `start()`.
+        """
+        if started is None:
+            return
+        self.record(stage, monotonic_time() - started)
+
+    def record(self, stage, value):
+        """Record a sample of a stage's timing.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = RollingHistogram(self.size)
+            histogram.record(value)
+
+    def count(self, name, n=1):
+        """Add to a counter.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """Return the histogram summaries (in seconds) and counters.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'stages': {stage: histogram.summary()
+                           for stage, histogram in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def log_summary(self):
+        """Log one line per stage, and the counters.
+        """
+        summary = self.summary()
+        for stage, s in sorted(summary['stages'].items()):
+            logger.info(f"{stage}: {s['count']} samples, "
+                        f"p50 {s['p50'] * 1000:.2f}ms, "
+                        f"p95 {s['p95'] * 1000:.2f}ms, "
+                        f"max {s['max'] * 1000:.2f}ms")
+        if summary['counters']:
+            logger.info(', '.join(f'{k}: {v}' for k, v in
+                                  sorted(summary['counters'].items())))
+
+
+# Shared by the plugin, the panels and the render worker
+METRICS = Metrics()
@@ -1,16 +1,64 @@
-from octoprint.util import ResettableTimer
+from PIL import Image
+from octoprint.util import ResettableTimer, monotonic_time
 
 try:
     from . import micro_panel
+    from . import spi_panel
 except (NotImplementedError, ImportError):
-    micro_panel = None
+    micro_panel = spi_panel = None
 
+from . import output
+from . import recording_panel
 from . import virtual_panel
 
 import logging
 logger = logging.getLogger("octoprint.plugins.display_panel.panels")
 
 
+# The labels of the buttons a panel can report
+BUTTONS = ('cancel', 'mode', 'pause', 'play')
+
+# The panel backends that can be enabled, by name. Each entry is a
+# factory called as `factory(width, height, button_callback)`, which
+# returns a panel object with the following methods:
+#
+#   fill(color), image(img), show(): set and show a frame
+#   poweroff(), poweron(): blank and restore the display
+#   shutdown(): release any resources, on plugin shutdown
+#   setup(settings): (optional) apply the plugin settings
+#
+# along with `width` and `height` attributes, and optionally a
+# `stats` dict of counters. Panels report button presses by calling
+# `button_callback(label)`, or `button_callback(label, pressed_at)`
+# with the `monotonic_time()` of the button edge if they know it.
+# Frames are passed to panels unrotated; each panel applies the
+# 'image_rotate' setting itself.
+# Other plugins can add backends through the
+# "octoprint.plugin.display_panel.panel_backends" hook.
+BACKENDS = {}
+
+
+def register_backend(name, factory):
+    """Make a panel backend available under the given name.
+    """
+    BACKENDS[name] = factory
+
+
+# The hardware panels, which are only offered if they successfully were
+# able to be imported
+HARDWARE_BACKENDS = ('micro_panel', 'spi_panel')
+
+if micro_panel is not None:
+    register_backend('micro_panel',
+                     lambda width, height, button_callback:
+                     micro_panel.MicroPanel(button_callback))
+    register_backend('spi_panel',
+                     lambda width, height, button_callback:
+                     spi_panel.SPIPanel(button_callback))
+register_backend('virtual_panel', virtual_panel.VirtualPanel)
+register_backend('recording', recording_panel.RecordingPanel)
+
+
 class DisplayTimer:
     """Coordination class for display timeout.
     """
@@ -89,6 +137,10 @@ class DisplayTimer:
     
 class Panels:
     """Proxy class for one or more panels that have a screen and buttons.
+
+    Frames are shown on each panel by an output worker of its own, once
+    the workers are started by `start()`.
+
     """
     # These are default values in case the MicroPanel is not
     # initialized. The VirtualPanel will always have the same
@@ -97,59 +149,184 @@ class Panels:
     width = 128
     height = 64
 
-    def __init__(self, settings, button_callback):
+    def __init__(self, settings, button_callback, power_callback=None):
         self.button_callback = button_callback
+        self.power_callback = power_callback or (lambda on: None)
         self.display_timer = DisplayTimer(settings, self)
         self.panels = []
-        
-        # Only try to connect to the micro panel if it successfully
-        # was able to be imported
-        if micro_panel is not None:
-            panel = micro_panel.MicroPanel(self.handle_button)
-            panel.setup(settings)
-            self.width, self.height = panel.width, panel.height
+        self.workers = []
+        self._image = None
+
+        # The first panel set up (normally the hardware panel) sets the
+        # dimensions for all the others.
+        for name in self.backend_names(settings):
+            try:
+                panel = BACKENDS[name](self.width, self.height,
+                                       self.handle_button)
+                if hasattr(panel, 'setup'):
+                    panel.setup(settings)
+            except Exception:
+                logger.exception(f'failed to set up the {name} panel')
+                continue
+            if not self.panels:
+                self.width, self.height = panel.width, panel.height
             self.panels.append(panel)
+            self.workers.append(output.OutputWorker(panel, name))
 
+    @staticmethod
+    def backend_names(settings):
+        """Return the names of the enabled panel backends, in order.
+
+        These are the backends listed in the 'panel_backends' setting,
+        followed by the virtual panel if it is enabled. Backends that
+        are not available are skipped, as are hardware panels after the
+        first, since they would share the button pins.
+
+        """
+        names = list(settings.get(["panel_backends"], merged=True) or [])
         if settings.get_boolean(["virtual_panel"], merged=True):
-            panel = virtual_panel.VirtualPanel(self.width, self.height,
-                                               self.handle_button)
-            self.panels.append(panel)
+            names.append('virtual_panel')
+
+        available = []
+        for name in names:
+            if name in available:
+                continue
+            if (name in HARDWARE_BACKENDS
+                    and any(n in HARDWARE_BACKENDS for n in available)):
+                logger.warning(f'only one hardware panel can be used, '
+                               f'skipping {name}')
+                continue
+            if name not in BACKENDS:
+                # The hardware panels are left out silently when their
+                # libraries are missing, as the micro panel always was
+                if name not in HARDWARE_BACKENDS:
+                    logger.warning(f'unknown panel backend {name}')
+                continue
+            available.append(name)
+        return available
 
     def setup(self, settings):
         """Apply the provided settings to all panels in this collection.
         """
         self.display_timer.setup(settings)
+        for worker in self.workers:
+            if hasattr(worker.panel, 'setup'):
+                with worker.lock:
+                    worker.panel.setup(settings)
+
+    def start(self):
+        """Start the output workers, so frames are shown in the
+        background.
+        """
+        for worker in self.workers:
+            worker.start()
+
+    def shutdown(self):
+        """Stop the output workers, once they have shown their last
+        frame, and shut down all panels.
+        """
+        for worker in self.workers:
+            worker.stop()
         for panel in self.panels:
-            if hasattr(panel, 'setup'):
-                panel.setup(settings)
+            panel.shutdown()
+
+    def fill(self, v):
+        """Set a frame filled with the specified color, to be shown
+        by `show()`.
+        """
+        self._image = Image.new("1", (self.width, self.height),
+                                255 if v else 0)
+
+    def image(self, img):
+        """Set an image to be shown by `show()`.
+
+        The image is shared by all panels, so it must not be changed
+        afterwards.
 
-    def handle_button(self, label):
+        """
+        self._image = img
+
+    def show(self, pressed_at=None):
+        """Post the frame set last to each panel's output worker.
+
+        `pressed_at` is the time of the button press the frame shows,
+        if any.
+
+        """
+        for worker in self.workers:
+            worker.post(self._image, pressed_at)
+
+    def handle_button(self, label, pressed_at=None):
         """Intercept button press events in order to either wake or poke
         the display timer.
+
+        `pressed_at` is the time of the button edge, on the
+        `monotonic_time()` clock; panels that don't know it leave it
+        to be taken now.
+
         """
+        if pressed_at is None:
+            pressed_at = monotonic_time()
+        if label not in BUTTONS:
+            raise ValueError(f'unknown button {label}')
+
         if self.display_timer.is_blank:
             # ignore this press, instead it's being used to wake the display
             self.display_timer.wake()
         else:
             self.display_timer.poke()
-            self.button_callback(label)
+            self.button_callback(label, pressed_at)
+
+    def poweroff(self):
+        """Notify the power callback, and turn all panels off.
+
+        The callback comes first, so that no more frames are rendered
+        for panels that are already off. Frames still on their way to
+        the panels are dropped.
 
-    def update_timer(self, printer_state):
-        """Pass printer state information to the display timer.
         """
-        self.display_timer.update(printer_state)
-                
-    def __getattr__(self, key):
-        """Proxy method calls to child panels.
+        self.power_callback(False)
+        for worker in self.workers:
+            with worker.lock:
+                worker.discard()
+                worker.powered = False
+                worker.panel.poweroff()
+
+    def poweron(self):
+        """Turn all panels on, and notify the power callback.
+        """
+        for worker in self.workers:
+            with worker.lock:
+                worker.panel.poweron()
+                worker.powered = True
+        self.power_callback(True)
 
-        Methods that are proxied are listed in proxy_methods.
+    def recorded_frames(self):
+        """Return the frames kept by the recording panel, oldest first,
+        as (time, image) tuples, or None if it is not enabled.
         """
-        proxy_methods = ('shutdown', 'fill', 'show', 'poweroff', 'poweron',
-                         'image')
-        if key not in proxy_methods:
-            raise AttributeError(f'attribute {key} not found')
+        for worker in self.workers:
+            if isinstance(worker.panel, recording_panel.RecordingPanel):
+                with worker.lock:
+                    return worker.panel.frames()
+        return None
 
-        def proxy(*args, **kwargs):
-            for panel in self.panels:
-                getattr(panel, key)(*args, **kwargs)
-        return proxy
+    @property
+    def stats(self):
+        """The counters of each panel that keeps any, by backend name.
+        """
+        return {worker.name: dict(worker.panel.stats)
+                for worker in self.workers if hasattr(worker.panel, 'stats')}
+
+    @property
+    def output_stats(self):
+        """The counters of each panel's output worker, by backend name:
+        frames shown and dropped, and the latency from posting a frame
+        to having shown it.
+        """
+        return {worker.name: worker.get_stats() for worker in self.workers}
+
+    def update_timer(self, printer_state):
+        """Pass printer state information to the display timer.
+        """
+        self.display_timer.update(printer_state)
@@ -0,0 +1,149 @@
+"""Direct access to a Linux I2C bus through its /dev/i2c-N device.
+
+`I2CDev` can stand in for `busio.I2C` as the bus of the display
+driver. It skips the layers of the Blinka stack: each transaction is
+written to the device with a single write() call, straight from the
+caller's buffer, and the device address is only selected when it
+changes rather than before every write.
+
+The bus device has to exist: a missing or wrong path is an error
+rather than a display that silently shows nothing. Tests and
+benchmarks that need no hardware use `FakeI2CDev` instead, which
+appends everything written to the bus to a file.
+
+"""
+import errno
+import fcntl
+import os
+import stat
+import threading
+from octoprint.util import monotonic_time
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.i2c_dev")
+
+# ioctl that selects the address of the device to talk to, from
+# linux/i2c-dev.h
+I2C_SLAVE = 0x0703
+
+
+
+class I2CDev:
+    """An I2C bus with the interface of `busio.I2C`, written through
+    the i2c-dev interface of the Linux kernel.
+    """
+    fake = False
+
+    def __init__(self, bus=1, path=None, frequency=None):
+        self.path = path or f'/dev/i2c-{bus}'
+        self.fd = self.open(self.path)
+        self.address = None
+        self.lock = threading.Lock()
+        self.transactions = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+        self.frequency = frequency
+        if frequency and not self.fake:
+            # The bus clock comes from the devicetree, e.g. through
+            # "dtparam=i2c_arm_baudrate=400000" in the Raspberry Pi's
+            # config.txt, and can't be changed through the bus device.
+            logger.warning(f'the I2C bus clock of {self.path} cannot be set '
+                           f'by the plugin; set it with "dtparam=i2c_arm_baudrate='
+                           f'{int(frequency)}" in config.txt instead')
+
+    def open(self, path):
+        """Open the bus device, which has to be an existing character
+        device.
+        """
+        try:
+            mode = os.stat(path).st_mode
+        except FileNotFoundError:
+            raise FileNotFoundError(
+                errno.ENOENT, f'{path} does not exist, is I2C enabled?', path
+            ) from None
+        if not stat.S_ISCHR(mode):
+            raise OSError(errno.ENODEV, f'{path} is not an I2C bus device')
+        return os.open(path, os.O_RDWR)
+
+    def select(self, address):
+        """Direct the following transactions to a device address.
+        """
+        if address != self.address:
+            if not self.fake:
+                fcntl.ioctl(self.fd, I2C_SLAVE, address)
+            self.address = address
+
+    def try_lock(self):
+        return self.lock.acquire(blocking=False)
+
+    def unlock(self):
+        self.lock.release()
+
+    def writeto(self, address, buffer, *, start=0, end=None, stop=True):
+        """Write a buffer (or a part of it) to a device in one
+        transaction.
+        """
+        self.select(address)
+        data = memoryview(buffer)[start:end]
+        started = monotonic_time()
+        written = os.write(self.fd, data)
+        self.write_time += monotonic_time() - started
+        if written != len(data):
+            raise OSError(errno.EIO, f'short write to {self.path}')
+        self.transactions += 1
+        self.bytes_written += written
+
+    def readfrom_into(self, address, buffer, *, start=0, end=None, stop=True):
+        """Read from a device into a buffer (or a part of it). A fake
+        device reads as zeros.
+        """
+        self.select(address)
+        data = memoryview(buffer)[start:end]
+        if self.fake:
+            data[:] = bytes(len(data))
+        else:
+            os.readv(self.fd, [data])
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, *,
+                              out_start=0, out_end=None,
+                              in_start=0, in_end=None, stop=False):
+        self.writeto(address, buffer_out, start=out_start, end=out_end)
+        self.readfrom_into(address, buffer_in, start=in_start, end=in_end)
+
+    def scan(self):
+        """Return the addresses of the devices that acknowledge a
+        zero-length write.
+        """
+        found = []
+        for address in range(0x08, 0x78):
+            try:
+                self.writeto(address, b'')
+            except OSError:
+                continue
+            found.append(address)
+        return found
+
+    def deinit(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
+
+
+class FakeI2CDev(I2CDev):
+    """An I2C bus that appends everything written to it to a file, for
+    tests and benchmarks. The file is created, or emptied if it exists.
+    """
+    fake = True
+
+    def __init__(self, path, frequency=None):
+        super().__init__(path=path, frequency=frequency)
+
+    def open(self, path):
+        return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND,
+                       0o644)
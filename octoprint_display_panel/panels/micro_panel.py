@@ -3,6 +3,25 @@ from board import SCL, SDA
 import busio
 import adafruit_ssd1306
 import RPi.GPIO as GPIO
+from octoprint.util import monotonic_time
+
+from ..metrics import METRICS
+from . import i2c_dev
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.micro_panel")
+
+# SSD1306 commands used to address a window of display RAM
+SET_COL_ADDR = 0x21
+SET_PAGE_ADDR = 0x22
+
+# SSD1306 commands that set the display orientation
+SET_SEG_REMAP = 0xA0
+SET_COM_OUT_DIR = 0xC0
+
+# Bytes spent on the bus to address a window before its data can be
+# sent: six two-byte commands plus the data control byte.
+WINDOW_OVERHEAD = 13
 
 
 def bcm2board(bcm_pin):
@@ -19,39 +38,38 @@ class MicroPanel:
     """
     width = 128
     height = 64
+    window_overhead = WINDOW_OVERHEAD
     
     def __init__(self, button_callback):
         self.button_event_callback = button_callback
         self.gpio_pinset = set()
+        self.rotated = False
+        self._last_frame = None
+        self.stats = {
+            'frames': 0,
+            'full_frames': 0,
+            'unchanged_frames': 0,
+            'windows': 0,
+            'bytes_sent': 0,
+            'bytes_skipped': 0,
+            'bus_bytes': 0,
+            'transfer_time': 0.0,
+            'throughput': 0,
+        }
         
     def setup(self, settings):
         """Apply settings from OctoPrint's SettingsPlugin mixin to
         configure the panel.
         """
-        self.i2c_address = int(settings.get(['i2c_address'], merged=True), 0)
+        self.setup_gpio_mode()
         self.input_pinset = {
-            settings.get_int([f'pin_{p}'], merged=True): p
+            self.gpio_pin(settings.get_int([f'pin_{p}'], merged=True)): p
             for p in ['cancel', 'mode', 'pause', 'play']
         }
         self.debounce_time = settings.get_int(['debounce'], merged=True)
     
         # set up display
-        self.i2c = busio.I2C(SCL, SDA)
-        self.disp = adafruit_ssd1306.SSD1306_I2C(
-            self.width, self.height, self.i2c, addr=self.i2c_address)
-
-        # set up GPIO mode
-        current_mode = GPIO.getmode()
-        if current_mode is None:
-            # set GPIO to BCM numbering
-            GPIO.setmode(GPIO.BCM)
-
-        elif current_mode != GPIO.BCM:
-            # remap to BOARD numbering
-            GPIO.setmode(current_mode)
-            self.input_pinset = {bcm2board(p): l
-                                 for p, l in self.input_pinset.items()}
-        GPIO.setwarnings(False)
+        self.setup_display(settings)
 
         # set up pins
         for gpio_pin in self.input_pinset:
@@ -77,6 +95,64 @@ class MicroPanel:
                 cleaned_pins.add(gpio_pin)
         self.gpio_pinset.difference_update(cleaned_pins)
 
+    def setup_gpio_mode(self):
+        """Use BCM pin numbering, unless another plugin already chose
+        a numbering.
+        """
+        current_mode = GPIO.getmode()
+        if current_mode is None:
+            # set GPIO to BCM numbering
+            GPIO.setmode(GPIO.BCM)
+            current_mode = GPIO.BCM
+
+        elif current_mode != GPIO.BCM:
+            # keep the BOARD numbering, pins are remapped by gpio_pin()
+            GPIO.setmode(current_mode)
+        self.gpio_mode = current_mode
+        GPIO.setwarnings(False)
+
+    def gpio_pin(self, bcm_pin):
+        """Translate a BCM pin number to the pin numbering in use.
+        """
+        if self.gpio_mode != GPIO.BCM:
+            return bcm2board(bcm_pin)
+        return bcm_pin
+
+    def setup_display(self, settings):
+        """Set up the display and the bus it is attached to.
+        """
+        self.i2c_address = int(settings.get(['i2c_address'], merged=True), 0)
+        if getattr(self, 'i2c', None) is not None:
+            self.i2c.deinit()
+        self.i2c = self.open_bus(settings)
+        self.disp = adafruit_ssd1306.SSD1306_I2C(
+            self.width, self.height, self.i2c, addr=self.i2c_address)
+        self.set_rotation(settings.get_boolean(['image_rotate'], merged=True))
+        # The driver clears the display during initialization, so the
+        # display RAM is known to be blank at this point.
+        self._last_frame = bytes(len(self.disp.buffer) - 1)
+
+    def open_bus(self, settings):
+        """Open the I2C bus through the configured transport.
+
+        The 'busio' transport goes through the Blinka stack, and
+        'i2c-dev' writes to the bus device directly. The device set as
+        'i2c_device' replaces the one of 'i2c_bus'; either has to exist.
+
+        """
+        transport = settings.get(['i2c_transport'], merged=True)
+        frequency = settings.get_int(['i2c_frequency'], merged=True) or None
+        if transport == 'i2c-dev':
+            return i2c_dev.I2CDev(
+                bus=settings.get_int(['i2c_bus'], merged=True),
+                path=settings.get(['i2c_device'], merged=True) or None,
+                frequency=frequency)
+        if transport != 'busio':
+            logger.warning(f'unknown I2C transport {transport}, using busio')
+        if frequency:
+            return busio.I2C(SCL, SDA, frequency=frequency)
+        return busio.I2C(SCL, SDA)
+
     def shutdown(self):
         """Called during plugin shutdown.
         """
@@ -94,12 +170,136 @@ class MicroPanel:
     def image(self, img):
         """Set an image to be shown on screen.
         """
+        started = METRICS.start()
         self.disp.image(img)
+        METRICS.stop('micro_panel.image', started)
 
     def show(self):
         """Show the currently set image on the screen.
+
+        Only the 8-row pages that changed since the last frame are
+        sent, and of those only the span of columns between the first
+        and last changed byte. The full frame is sent instead when that
+        is cheaper, or when the display RAM contents are unknown.
+
+        """
+        started = METRICS.start()
+        frame = self.framebuffer()
+        last_frame, self._last_frame = self._last_frame, None
+        self.stats['frames'] += 1
+
+        windows = self.dirty_windows(last_frame, frame)
+        transfer_started = monotonic_time()
+        if windows is None:
+            bus_bytes = self.write_frame(frame)
+            sent = len(frame)
+            self.stats['full_frames'] += 1
+        else:
+            for page, start, end in windows:
+                offset = page * self.width
+                self.write_window(page, start, end,
+                                  frame[offset + start:offset + end + 1])
+            sent = sum(end - start + 1 for _, start, end in windows)
+            bus_bytes = self.window_overhead * len(windows) + sent
+            if not windows:
+                self.stats['unchanged_frames'] += 1
+            self.stats['windows'] += len(windows)
+            self.stats['bytes_skipped'] += len(frame) - sent
+        self.record_transfer(bus_bytes, monotonic_time() - transfer_started)
+        self.stats['bytes_sent'] += sent
+        self._last_frame = frame
+        METRICS.stop('micro_panel.show', started)
+
+    def record_transfer(self, bus_bytes, elapsed):
+        """Account for the bytes of a frame sent over the bus, and the
+        time it took.
+
+        The 'throughput' stat is the rate achieved by the last frame
+        that sent anything, in bytes per second.
+
+        """
+        if not bus_bytes:
+            return
+        self.stats['bus_bytes'] += bus_bytes
+        self.stats['transfer_time'] += elapsed
+        if elapsed > 0:
+            self.stats['throughput'] = int(bus_bytes / elapsed)
+        METRICS.record('micro_panel.transfer', elapsed)
+
+    def dirty_windows(self, old, new):
+        """Compare two framebuffers and return the windows that differ.
+
+        Returns a list of (page, first column, last column) tuples, or
+        None if sending the full frame would be cheaper.
+
+        """
+        if old is None or len(old) != len(new):
+            return None
+
+        windows = []
+        cost = 0
+        for offset in range(0, len(new), self.width):
+            old_page = old[offset:offset + self.width]
+            new_page = new[offset:offset + self.width]
+            if old_page == new_page:
+                continue
+            # XOR the page as one big integer; the highest and lowest
+            # set bits locate the first and last changed columns.
+            diff = (int.from_bytes(old_page, 'big')
+                    ^ int.from_bytes(new_page, 'big'))
+            start = self.width - 1 - (diff.bit_length() - 1) // 8
+            end = self.width - 1 - ((diff & -diff).bit_length() - 1) // 8
+            windows.append((offset // self.width, start, end))
+            cost += self.window_overhead + end - start + 1
+
+        if cost >= len(new):
+            return None
+        return windows
+
+    def framebuffer(self):
+        """Return the frame set by `image()`, in display RAM layout.
+        """
+        return bytes(self.disp.buffer[1:])
+
+    def write_frame(self, frame):
+        """Write a full frame to display RAM, and return the number of
+        bytes sent over the bus.
         """
         self.disp.show()
+        return WINDOW_OVERHEAD + len(frame)
+
+    def write_window(self, page, start, end, data):
+        """Write data to a single page of display RAM, between the start
+        and end columns (inclusive).
+        """
+        col_offset = (128 - self.width) // 2
+        for cmd in (SET_COL_ADDR, start + col_offset, end + col_offset,
+                    SET_PAGE_ADDR, page, page):
+            self.write_cmd(cmd)
+        with self.disp.i2c_device:
+            self.disp.i2c_device.write(b'\x40' + data)
+
+    def write_cmd(self, cmd):
+        """Send a single command byte to the display controller.
+        """
+        self.disp.write_cmd(cmd)
+
+    def set_rotation(self, rotated):
+        """Set whether the display output is rotated by 180 degrees.
+
+        The rotation is done by the display controller, by reversing
+        the column mapping and the row scan direction, so frames are
+        sent as they are drawn.
+
+        """
+        # The driver's default orientation already reverses both.
+        remap = 0 if rotated else 1
+        self.write_cmd(SET_SEG_REMAP | remap)
+        self.write_cmd(SET_COM_OUT_DIR | (remap << 3))
+        self.rotated = rotated
+        # The column mapping only applies to data written from now on,
+        # so the next frame has to be sent in full.
+        self._last_frame = None
 
     def poweroff(self):
         """Turn the display off.
@@ -114,8 +314,11 @@ class MicroPanel:
     def handle_gpio_event(self, channel):
         """Called on a GPIO event, translate an input channel to a button label
         and invokes the button callback function with that label.
+
+        The time of the edge is taken first thing, and passed along.
         """
+        pressed_at = monotonic_time()
         if channel not in self.input_pinset:
             return
 
-        self.button_event_callback(self.input_pinset[channel])
+        self.button_event_callback(self.input_pinset[channel], pressed_at)
@@ -0,0 +1,175 @@
+"""Background output of frames to the panels.
+
+Showing a frame takes very different times on different panels: a full
+frame over I2C takes tens of milliseconds, while the virtual panel only
+keeps a reference to it. Showing frames on each panel in turn would
+hold every panel (and the render worker) back by the slowest one, or
+stall them all on a wedged bus. Instead, each panel gets a worker
+thread of its own.
+
+A worker has a mailbox for a single frame. A frame posted while the
+previous one is still waiting replaces it, as only the latest frame is
+worth showing; the replaced one is counted as dropped.
+
+A frame drawn in response to a button press carries the time of the
+button edge, so the time from the press to the frame being on the
+display (press-to-photon) can be measured. A frame that replaces such
+a frame in the mailbox inherits that time, since it shows the press
+too.
+
+"""
+import threading
+from octoprint.util import monotonic_time
+
+from ..metrics import METRICS
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.output")
+
+
+class OutputWorker:
+    """A thread that shows the frames posted to it on one panel.
+
+    Until the worker is started (and after it is stopped), frames are
+    shown right away on the thread that posts them.
+
+    Anything else done with the panel while the worker may be showing a
+    frame, such as powering it off, has to hold `lock`. Frames are not
+    shown while the panel is powered off.
+
+    """
+    def __init__(self, panel, name):
+        self.panel = panel
+        self.name = name
+        self.lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._frame = None
+        self._posted_at = None
+        self._pressed_at = None
+        self._running = False
+        self._thread = None
+        self.powered = True
+        self.stats = {
+            'frames': 0,
+            'dropped': 0,
+            'errors': 0,
+            'latency_last': 0.0,
+            'latency_max': 0.0,
+            'latency_total': 0.0,
+            'press_frames': 0,
+            'press_latency_last': 0.0,
+            'press_latency_max': 0.0,
+        }
+
+    def start(self):
+        """Start the worker thread, if it is not already running.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name=f"DisplayPanelOutput-{self.name}",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker thread, once it has shown the frame waiting
+        in the mailbox, if any.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def post(self, frame, pressed_at=None):
+        """Put a frame in the mailbox, replacing any frame still
+        waiting there.
+
+        `pressed_at` is the time of the button press the frame shows,
+        if any, on the `monotonic_time()` clock.
+
+        """
+        with self._cond:
+            if self._frame is not None:
+                self.stats['dropped'] += 1
+                if (self._pressed_at is not None
+                        and (pressed_at is None or self._pressed_at < pressed_at)):
+                    pressed_at = self._pressed_at
+            self._frame = frame
+            self._posted_at = monotonic_time()
+            self._pressed_at = pressed_at
+            running = self._running
+            self._cond.notify_all()
+        if not running:
+            self._show_next()
+
+    def discard(self):
+        """Drop the frame waiting in the mailbox, if any.
+        """
+        with self._cond:
+            if self._frame is not None:
+                self.stats['dropped'] += 1
+            self._frame = self._pressed_at = None
+
+    def get_stats(self):
+        """Return a snapshot of the worker's counters.
+        """
+        with self._cond:
+            stats = dict(self.stats)
+            stats['queue_depth'] = 0 if self._frame is None else 1
+        frames = stats['frames']
+        stats['latency_avg'] = stats['latency_total'] / frames if frames else 0.0
+        return stats
+
+    def _show_next(self):
+        """Take the frame out of the mailbox and show it.
+        """
+        with self._cond:
+            frame, posted_at = self._frame, self._posted_at
+            pressed_at = self._pressed_at
+            self._frame = self._pressed_at = None
+        if frame is None:
+            return
+
+        with self.lock:
+            if not self.powered:
+                with self._cond:
+                    self.stats['dropped'] += 1
+                return
+            try:
+                self.panel.image(frame)
+                self.panel.show()
+            except Exception:
+                logger.exception(f"Failed to show a frame on the {self.name} panel")
+                with self._cond:
+                    self.stats['errors'] += 1
+                return
+
+        shown = monotonic_time()
+        latency = shown - posted_at
+        METRICS.record(f'output.{self.name}.latency', latency)
+        if pressed_at is not None:
+            METRICS.record(f'output.{self.name}.press_to_photon',
+                           shown - pressed_at)
+        with self._cond:
+            self.stats['frames'] += 1
+            self.stats['latency_last'] = latency
+            self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+            self.stats['latency_total'] += latency
+            if pressed_at is not None:
+                self.stats['press_frames'] += 1
+                self.stats['press_latency_last'] = shown - pressed_at
+                self.stats['press_latency_max'] = max(
+                    self.stats['press_latency_max'], shown - pressed_at)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and self._frame is None:
+                    self._cond.wait()
+                if self._frame is None:
+                    return
+            self._show_next()
@@ -0,0 +1,164 @@
+import os
+import time
+from io import BytesIO
+from PIL import Image
+
+from ..metrics import METRICS
+from .virtual_panel import rotate_180
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.recording_panel")
+
+
+def encode_pbm(image):
+    """Encode a frame as a binary PBM file.
+    """
+    bio = BytesIO()
+    image.save(bio, format='ppm')
+    return bio.getvalue()
+
+
+# The formats recorded frames can be fetched in through the API: the
+# packed 1-bit framebuffer (rows MSB first) or a PBM file
+FRAME_ENCODERS = {
+    'raw': lambda image: image.tobytes(),
+    'pbm': encode_pbm,
+}
+
+
+class RecordingPanel:
+    """A headless panel that records the frames it is shown.
+
+    The most recent frames are kept in memory, in a ring buffer that is
+    allocated once, as packed 1-bit framebuffers along with the time
+    they were shown. Optionally, each frame is also written to a PBM
+    file, named after that time, in the recording directory.
+
+    Like a real panel, it shows a blank frame while powered off, and
+    it applies the 'image_rotate' setting, so the frames recorded are
+    the ones the display shows.
+
+    """
+    # Frames kept in memory by default
+    RING_SIZE = 256
+
+    def __init__(self, width, height, button_callback):
+        self.width = width
+        self.height = height
+        self.frame_size = (width + 7) // 8 * height
+        self.directory = None
+        self.rotated = False
+        self.powered = True
+        self._image = Image.new("1", (width, height))
+        self._blank = bytes(self.frame_size)
+        self._allocate(self.RING_SIZE)
+        self.stats = {
+            'frames': 0,
+            'files_written': 0,
+            'file_errors': 0,
+        }
+
+    def _allocate(self, size):
+        self.ring_size = size
+        self._ring = bytearray(self.frame_size * size)
+        self._times = [None] * size
+        self._next = 0
+
+    def setup(self, settings):
+        """Apply settings from OctoPrint's SettingsPlugin mixin.
+        """
+        size = settings.get_int(['recording_frames'], merged=True)
+        if size is not None and size > 0 and size != self.ring_size:
+            self._allocate(size)
+
+        self.rotated = settings.get_boolean(['image_rotate'], merged=True)
+        self.directory = settings.get(['recording_directory'], merged=True) or None
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def shutdown(self):
+        pass # not needed
+
+    def fill(self, v):
+        """Fill the panel with the specified color.
+        """
+        self._image = Image.new("1", (self.width, self.height),
+                                255 if v else 0)
+
+    def image(self, img):
+        """Set a new image to be shown on the panel.
+        """
+        if self.rotated:
+            started = METRICS.start()
+            img = rotate_180(img)
+            METRICS.stop('recording_panel.rotate', started)
+        self._image = img
+
+    def show(self):
+        """Record the currently set image, if the panel is powered on.
+        """
+        if self.powered:
+            self.record(self._image)
+
+    def poweroff(self):
+        """Record a blank frame, until powered on again.
+        """
+        self.powered = False
+        self.record(None)
+
+    def poweron(self):
+        """Record the currently set image again.
+        """
+        self.powered = True
+        self.record(self._image)
+
+    def record(self, img):
+        """Add a frame to the ring buffer, replacing the oldest one, and
+        write it to a file if a recording directory is set.
+
+        A frame of None is recorded as blank.
+
+        """
+        data = self._blank if img is None else img.tobytes()
+        slot = self._next
+        offset = slot * self.frame_size
+        self._ring[offset:offset + self.frame_size] = data
+        self._times[slot] = time.time()
+        self._next = (slot + 1) % self.ring_size
+        self.stats['frames'] += 1
+
+        if self.directory:
+            self.write_file(self._times[slot], data)
+
+    def write_file(self, timestamp, data):
+        """Write a frame to a PBM file in the recording directory.
+        """
+        name = (time.strftime('%Y%m%d-%H%M%S', time.localtime(timestamp))
+                + f'.{int(timestamp * 1000) % 1000:03d}'
+                + f'-{self.stats["frames"]:06d}.pbm')
+        try:
+            self.to_image(data).save(os.path.join(self.directory, name))
+        except OSError:
+            self.stats['file_errors'] += 1
+            logger.exception(f'failed to write frame {name}')
+        else:
+            self.stats['files_written'] += 1
+
+    def to_image(self, data):
+        """Turn a recorded framebuffer back into an image.
+        """
+        return Image.frombytes("1", (self.width, self.height), bytes(data))
+
+    def frames(self):
+        """Return the recorded frames, oldest first, as a list of
+        (time, image) tuples.
+        """
+        frames = []
+        for i in range(self.ring_size):
+            slot = (self._next + i) % self.ring_size
+            if self._times[slot] is None:
+                continue
+            offset = slot * self.frame_size
+            frames.append((self._times[slot], self.to_image(
+                self._ring[offset:offset + self.frame_size])))
+        return frames
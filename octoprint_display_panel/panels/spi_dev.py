@@ -0,0 +1,119 @@
+"""Direct access to a display on a Linux SPI bus, through its
+/dev/spidevB.C device.
+
+Displays on a 4-wire SPI bus have a data/command line besides the SPI
+signals, which tells them whether the bytes sent are commands or
+display RAM contents. `SPIDev` sets it through a callback before each
+transfer that needs it changed, and writes each transfer with a single
+write() call.
+
+Like `i2c_dev.I2CDev`, it requires the bus device to exist. Tests and
+benchmarks use `FakeSPIDev` instead, which records every transfer in a
+file as a one-byte kind (0 for commands, 1 for data), the length as two
+bytes (little-endian) and the bytes sent; `read_transfers()` reads
+them back.
+
+"""
+import errno
+import fcntl
+import os
+import stat
+import struct
+from octoprint.util import monotonic_time
+
+# ioctls that set the SPI mode and the clock, from linux/spi/spidev.h
+SPI_IOC_WR_MODE = 0x40016b01
+SPI_IOC_WR_MAX_SPEED_HZ = 0x40046b04
+
+# The largest transfer spidev accepts by default (its bufsiz parameter)
+MAX_TRANSFER = 4096
+
+TRANSFER_HEADER = struct.Struct('<BH')
+
+
+class SPIDev:
+    """A write-only SPI bus to a display, through the spidev interface
+    of the Linux kernel.
+    """
+    fake = False
+
+    def __init__(self, bus=0, chip_select=0, path=None,
+                 frequency=8000000, dc=None):
+        self.path = path or f'/dev/spidev{bus}.{chip_select}'
+        self.fd = self.open(self.path, frequency)
+        self.frequency = frequency
+        self.dc = dc or (lambda level: None)
+        self.dc_level = None
+        self.transactions = 0
+        self.bytes_written = 0
+        self.write_time = 0.0
+
+    def open(self, path, frequency):
+        """Open the bus device, which has to be an existing character
+        device, and set the SPI mode and clock.
+        """
+        if not stat.S_ISCHR(os.stat(path).st_mode):
+            raise OSError(errno.ENODEV, f'{path} is not an SPI bus device')
+        fd = os.open(path, os.O_RDWR)
+        try:
+            fcntl.ioctl(fd, SPI_IOC_WR_MODE, struct.pack('B', 0))
+            fcntl.ioctl(fd, SPI_IOC_WR_MAX_SPEED_HZ,
+                        struct.pack('<I', int(frequency)))
+        except OSError:
+            os.close(fd)
+            raise
+        return fd
+
+    def write(self, data, command=False):
+        """Send commands, or display RAM contents, to the display.
+        """
+        level = not command
+        if level != self.dc_level:
+            self.dc(level)
+            self.dc_level = level
+
+        data = memoryview(data)
+        started = monotonic_time()
+        for offset in range(0, len(data), MAX_TRANSFER):
+            chunk = data[offset:offset + MAX_TRANSFER]
+            if self.fake:
+                os.write(self.fd, TRANSFER_HEADER.pack(level, len(chunk)))
+            os.write(self.fd, chunk)
+            self.transactions += 1
+        self.write_time += monotonic_time() - started
+        self.bytes_written += len(data)
+
+    def deinit(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FakeSPIDev(SPIDev):
+    """An SPI bus that records every transfer in a file, for tests and
+    benchmarks. The file is created, or emptied if it exists.
+    """
+    fake = True
+
+    def __init__(self, path, frequency=8000000, dc=None):
+        super().__init__(path=path, frequency=frequency, dc=dc)
+
+    def open(self, path, frequency):
+        return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND,
+                       0o644)
+
+
+def read_transfers(path):
+    """Return the transfers recorded by a fake device, as a list of
+    (command, bytes) tuples.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    transfers = []
+    offset = 0
+    while offset < len(data):
+        level, length = TRANSFER_HEADER.unpack_from(data, offset)
+        offset += TRANSFER_HEADER.size
+        transfers.append((not level, data[offset:offset + length]))
+        offset += length
+    return transfers
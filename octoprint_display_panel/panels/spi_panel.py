@@ -0,0 +1,205 @@
+import time
+from PIL import Image
+
+import RPi.GPIO as GPIO
+
+from . import spi_dev
+from .micro_panel import MicroPanel
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.spi_panel")
+
+# Page addressing commands, supported by both controllers
+SET_PAGE = 0xB0
+SET_LOW_COLUMN = 0x00
+SET_HIGH_COLUMN = 0x10
+
+SET_DISP = 0xAE
+
+# The commands that set up each controller for a 128x64 display, which
+# leave it blank and in page addressing mode. The orientation is set
+# separately, by set_rotation().
+INIT_COMMANDS = {
+    'ssd1306': (
+        SET_DISP,
+        0x20, 0x02,     # page addressing
+        0x40,           # start line 0
+        0xA8, 0x3F,     # multiplex ratio: 64 rows
+        0xD3, 0x00,     # no display offset
+        0xDA, 0x12,     # alternative COM pin configuration
+        0xD5, 0x80,     # clock divide ratio and oscillator frequency
+        0xD9, 0xF1,     # precharge period, for the internal supply
+        0xDB, 0x30,     # VCOM deselect level
+        0x81, 0xFF,     # contrast
+        0xA4,           # show the display RAM
+        0xA6,           # not inverted
+        0x8D, 0x14,     # enable the charge pump
+    ),
+    'sh1106': (
+        SET_DISP,
+        0x40,           # start line 0
+        0xA8, 0x3F,     # multiplex ratio: 64 rows
+        0xD3, 0x00,     # no display offset
+        0xDA, 0x12,     # alternative COM pin configuration
+        0xD5, 0x80,     # clock divide ratio and oscillator frequency
+        0xAD, 0x8B,     # enable the DC-DC converter
+        0xD9, 0x22,     # precharge period
+        0xDB, 0x35,     # VCOM deselect level
+        0x81, 0xFF,     # contrast
+        0xA4,           # show the display RAM
+        0xA6,           # not inverted
+    ),
+}
+
+# The SH1106 has 132 columns of display RAM, of which the middle 128
+# are shown.
+COLUMN_OFFSET = {
+    'ssd1306': 0,
+    'sh1106': 2,
+}
+
+
+def to_pages(img):
+    """Convert a 1-bit image to display RAM layout: one byte per column
+    for each 8-row page, with the top row in the lowest bit.
+
+    Rotating the image by 90 degrees clockwise turns its columns into
+    rows of packed bytes, bottom row first, so that each byte holds the
+    bits of a page in the right order. Rotating those bytes back, as an
+    8-bit image, puts them in page order. Both rotations are done by
+    Pillow, instead of setting the display RAM pixel by pixel.
+
+    """
+    width, height = img.size
+    columns = img.transpose(Image.ROTATE_270)
+    pages = Image.frombytes('L', (height // 8, width), columns.tobytes())
+    return pages.transpose(Image.ROTATE_90).tobytes()
+
+
+class SPIPanel(MicroPanel):
+    """A Micro Panel whose SSD1306 or SH1106 display is attached over
+    4-wire SPI.
+
+    Frames are converted to display RAM layout here, and written with
+    page addressing, which both controllers support. The buttons are
+    handled as for the I2C Micro Panel.
+
+    """
+    # Bytes spent on the bus to address a window: the page and the two
+    # halves of the start column.
+    window_overhead = 3
+
+    def __init__(self, button_callback):
+        super().__init__(button_callback)
+        self.spi = None
+        self.output_pins = set()
+        self._frame = bytes(self.width * self.height // 8)
+
+    def setup_display(self, settings):
+        """Set up the display and the SPI bus it is attached to.
+        """
+        self.controller = settings.get(['spi_controller'], merged=True)
+        if self.controller not in INIT_COMMANDS:
+            logger.warning(f'unknown SPI display controller {self.controller}, '
+                           f'using ssd1306')
+            self.controller = 'ssd1306'
+        self.column_offset = COLUMN_OFFSET[self.controller]
+
+        self.dc_pin = self.gpio_pin(settings.get_int(['spi_dc_pin'], merged=True))
+        reset_pin = self.gpio_pin(settings.get_int(['spi_reset_pin'], merged=True))
+        for gpio_pin in (self.dc_pin, reset_pin):
+            if gpio_pin != -1:
+                GPIO.setup(gpio_pin, GPIO.OUT)
+                self.output_pins.add(gpio_pin)
+
+        if self.spi is not None:
+            self.spi.deinit()
+        self.spi = self.open_bus(settings)
+
+        if reset_pin != -1:
+            GPIO.output(reset_pin, GPIO.LOW)
+            time.sleep(0.01)
+            GPIO.output(reset_pin, GPIO.HIGH)
+
+        self.write_cmds(INIT_COMMANDS[self.controller])
+        self.set_rotation(settings.get_boolean(['image_rotate'], merged=True))
+        self.write_frame(bytes(len(self._frame)))
+        self.poweron()
+        self._last_frame = bytes(len(self._frame))
+
+    def open_bus(self, settings):
+        """Open the SPI bus device the display is attached to.
+        """
+        return spi_dev.SPIDev(
+            bus=settings.get_int(['spi_bus'], merged=True),
+            chip_select=settings.get_int(['spi_chip_select'], merged=True),
+            path=settings.get(['spi_device'], merged=True) or None,
+            frequency=settings.get_int(['spi_frequency'], merged=True),
+            dc=self.set_dc)
+
+    def set_dc(self, level):
+        """Set the data/command line: high for data, low for commands.
+        """
+        if self.dc_pin != -1:
+            GPIO.output(self.dc_pin, level)
+
+    def shutdown(self):
+        """Called during plugin shutdown.
+        """
+        super().shutdown()
+        for gpio_pin in self.output_pins:
+            GPIO.cleanup(gpio_pin)
+        if self.spi is not None:
+            self.spi.deinit()
+            self.spi = None
+
+    def fill(self, v):
+        """Fill the screen with the specified color.
+        """
+        self._frame = bytes([0xFF if v else 0x00]) * len(self._frame)
+
+    def image(self, img):
+        """Set an image to be shown on screen.
+        """
+        self._frame = to_pages(img)
+
+    def framebuffer(self):
+        return self._frame
+
+    def write_frame(self, frame):
+        """Write a full frame to display RAM, one page at a time, and
+        return the number of bytes sent over the bus.
+        """
+        for page in range(self.height // 8):
+            offset = page * self.width
+            self.write_window(page, 0, self.width - 1,
+                              frame[offset:offset + self.width])
+        return (self.window_overhead + self.width) * (self.height // 8)
+
+    def write_window(self, page, start, end, data):
+        """Write data to a single page of display RAM, from the start
+        column on.
+        """
+        column = start + self.column_offset
+        self.write_cmds((SET_PAGE | page,
+                         SET_LOW_COLUMN | (column & 0x0F),
+                         SET_HIGH_COLUMN | (column >> 4)))
+        self.spi.write(data)
+
+    def write_cmd(self, cmd):
+        self.write_cmds((cmd,))
+
+    def write_cmds(self, cmds):
+        """Send a sequence of command bytes in one transfer.
+        """
+        self.spi.write(bytes(cmds), command=True)
+
+    def poweroff(self):
+        """Turn the display off.
+        """
+        self.write_cmd(SET_DISP)
+
+    def poweron(self):
+        """Turn the display on.
+        """
+        self.write_cmd(SET_DISP | 0x01)
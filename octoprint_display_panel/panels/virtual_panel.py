@@ -1,14 +1,66 @@
 import flask
 import base64
+import math
+import threading
 from PIL import Image, ImageDraw
 from io import BytesIO
 
 import octoprint.plugin
+from octoprint.util import monotonic_time
+
+from ..metrics import METRICS
 
 import logging
 logger = logging.getLogger("octoprint.plugins.display_panel.virtual_panel")
 
 
+def encode_png(image):
+    """Encode a frame as a PNG data URI.
+    """
+    bio = BytesIO()
+    image.save(bio, format='png')
+    image_encoded = base64.b64encode(bio.getvalue()).decode('ascii')
+    return {'image_data': 'data:image/png;base64,' + image_encoded}
+
+
+def encode_raw(image):
+    """Encode a frame as its packed 1-bit framebuffer.
+
+    Rows are packed MSB first, each padded to a whole number of
+    bytes, and set bits are lit pixels.
+
+    """
+    return {
+        'width': image.width,
+        'height': image.height,
+        'frame': base64.b64encode(image.tobytes()).decode('ascii'),
+    }
+
+
+# Maps each byte to the byte with its bits in reverse order
+REVERSED_BITS = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+
+def rotate_180(image):
+    """Rotate a 1-bit image by 180 degrees.
+
+    When each row fills a whole number of bytes, this is the packed
+    framebuffer in reverse, with the bits of each byte reversed.
+
+    """
+    if image.mode != '1' or image.width % 8:
+        return image.rotate(angle=180)
+    data = image.tobytes()[::-1].translate(REVERSED_BITS)
+    return Image.frombytes('1', image.size, data)
+
+
+# The frame formats available through the API
+FRAME_ENCODERS = {
+    'png': encode_png,
+    'raw': encode_raw,
+}
+
+
 class VirtualPanelMixin(octoprint.plugin.SimpleApiPlugin,
                         octoprint.plugin.AssetPlugin):
     """Mixin class for the main plugin class to add API and assets for the
@@ -19,9 +71,11 @@ class VirtualPanelMixin(octoprint.plugin.SimpleApiPlugin,
     included directly in the plugin's __init__.py. They are done here
     in order to co-locate the plugin API handler and the logic for
     managing the virtual panel. The key assumption is that the plugin
-    will not need to use SimpleApiPlugin or AssetPlugin for any other
-    functionality -- if this assumption is no longer correct, then it
-    will be best to move the functions of this mixin into the main
+    will not need to use SimpleApiPlugin or AssetPlugin for much other
+    functionality -- the plugin class adds its own API commands (such
+    as 'stats') by extending `get_api_commands()` and
+    `on_api_command()`, but if it grows beyond that, then it will be
+    best to move the functions of this mixin into the main
     __init__.py and remove this mixin.
 
     """
@@ -32,12 +86,37 @@ class VirtualPanelMixin(octoprint.plugin.SimpleApiPlugin,
     # structure that can be referenced from both is needed to exchange
     # information. This structure is updated by the @classmethods
     # below, which are called from VirtualPanel. Button presses coming
-    # through the API trigger the `button_callback`, while raw image
-    # data is passed through `image_data`.
+    # through the API trigger the `button_callback`, while frames are
+    # passed through `image` and numbered by `version`. Frames are
+    # only encoded for the web UI when requested through the API; the
+    # most recent encoding in each format is kept in `encoded` as
+    # {format: (version, data)}. The `frame_callback` is notified with
+    # the version of each new frame, and API requests waiting for a
+    # new frame (`waiters` of them) are woken through `frame_ready`.
     _VP_ACTIVE_COMM = {
-        'image_data': None,
-        'button_callback': (lambda l: None)
+        'image': None,
+        'version': 0,
+        'encoded': {},
+        'lock': threading.Lock(),
+        'button_callback': (lambda l: None),
+        'frame_callback': (lambda v: None),
+        'waiters': 0,
+        'stats': {'frames': 0, 'encodes': 0, 'encode_time': 0.0,
+                  'waits': 0, 'waits_timed_out': 0, 'waits_rejected': 0},
     }
+    _VP_ACTIVE_COMM['frame_ready'] = threading.Condition(_VP_ACTIVE_COMM['lock'])
+
+    # API requests waiting for a new frame each hold one of OctoPrint's
+    # request handler threads, so only this many may wait at once;
+    # further requests get the current frame right away.
+    VP_MAX_WAITERS = 2
+
+    # The longest time, in seconds, a request may wait for a new frame
+    VP_MAX_WAIT = 30
+
+    # The longest time, in seconds, a button press waits for the frame
+    # showing its result
+    VP_PRESS_WAIT = 0.5
 
     @classmethod
     def vp_register_callback(cls, button_callback):
@@ -45,16 +124,99 @@ class VirtualPanelMixin(octoprint.plugin.SimpleApiPlugin,
         """
         cls._VP_ACTIVE_COMM['button_callback'] = button_callback
 
+    @classmethod
+    def vp_register_frame_callback(cls, frame_callback):
+        """Set the callback to notify of the version of each new frame.
+        """
+        cls._VP_ACTIVE_COMM['frame_callback'] = frame_callback
+
     @classmethod
     def vp_set_image(cls, image):
         """Set the currently displayed image.
         """
-        bio = BytesIO()
-        image.save(bio, format='png')
-        bio.seek(0)
-        image_data = bio.read()
-        image_encoded = base64.b64encode(image_data).decode('ascii')
-        cls._VP_ACTIVE_COMM['image_data'] = 'data:image/png;base64,' + image_encoded
+        started = METRICS.start()
+        comm = cls._VP_ACTIVE_COMM
+        with comm['lock']:
+            comm['image'] = image
+            comm['version'] += 1
+            comm['stats']['frames'] += 1
+            version = comm['version']
+            comm['frame_ready'].notify_all()
+        comm['frame_callback'](version)
+        METRICS.stop('virtual_panel.set_image', started)
+
+    @classmethod
+    def vp_wait_for_frame(cls, since, timeout):
+        """Wait until the frame version differs from `since`.
+
+        Returns True once it does, or False if the timeout expired or
+        too many requests are already waiting.
+
+        """
+        comm = cls._VP_ACTIVE_COMM
+        with comm['lock']:
+            if comm['version'] != since:
+                return True
+            if comm['waiters'] >= cls.VP_MAX_WAITERS:
+                comm['stats']['waits_rejected'] += 1
+                return False
+
+            comm['waiters'] += 1
+            comm['stats']['waits'] += 1
+            try:
+                changed = comm['frame_ready'].wait_for(
+                    lambda: comm['version'] != since, timeout)
+            finally:
+                comm['waiters'] -= 1
+            if not changed:
+                comm['stats']['waits_timed_out'] += 1
+            return changed
+
+    @classmethod
+    def vp_get_frame(cls, format='png'):
+        """Return the current image, encoded in the given format.
+
+        The result is a dict of the encoded data along with the
+        frame's `version` and `format`. Each version is encoded at
+        most once per format, no matter how many requests ask for it.
+
+        """
+        comm = cls._VP_ACTIVE_COMM
+        with comm['lock']:
+            version = comm['version']
+            cached_version, data = comm['encoded'].get(format, (None, None))
+            if cached_version != version:
+                if comm['image'] is None:
+                    data = {}
+                else:
+                    started = monotonic_time()
+                    data = FRAME_ENCODERS[format](comm['image'])
+                    elapsed = monotonic_time() - started
+                    comm['stats']['encodes'] += 1
+                    comm['stats']['encode_time'] += elapsed
+                    METRICS.record(f'virtual_panel.encode_{format}', elapsed)
+                comm['encoded'][format] = (version, data)
+        return dict(data, version=version, format=format)
+
+    @classmethod
+    def vp_get_stats(cls):
+        """Return the number of frames set and encoded, and the total
+        time spent encoding them.
+        """
+        comm = cls._VP_ACTIVE_COMM
+        with comm['lock']:
+            return dict(comm['stats'])
+
+    def vp_push_frame(self, version):
+        """Announce a new frame to connected web UIs.
+
+        Only the version is sent, so that frames are not encoded and
+        sent to every browser whether or not the panel is on screen.
+        Web UIs that show the panel fetch the frame through the API.
+
+        """
+        self._plugin_manager.send_plugin_message(
+            self._identifier, {'type': 'frame', 'version': version})
 
     # ~ SimpleApiPlugin
         
@@ -67,21 +229,54 @@ class VirtualPanelMixin(octoprint.plugin.SimpleApiPlugin,
         """Handle an incoming API request.
         """
         self._logger.info(f'command was {command} and data {data}')
+        format = data.get('format', 'png')
+        if format not in FRAME_ENCODERS:
+            return flask.abort(400, f"{format} is not a valid frame format")
         if command == 'press':
+            with self._VP_ACTIVE_COMM['lock']:
+                version = self._VP_ACTIVE_COMM['version']
             try:
                 self._VP_ACTIVE_COMM['button_callback'](data['button'])
             except ValueError:
                 return flask.abort(
                     400, f"{data['button']} is not a valid button name"
                 )
-        # We always return the current state of the display, which may
-        # include updates based on a processed button press.
-        return self.on_api_get(None)
+            # The press is handled in the background, so give the frame
+            # showing its result a moment to arrive.
+            self.vp_wait_for_frame(version, self.VP_PRESS_WAIT)
+        # We always return the current state of the display.
+        return self.vp_frame_response(format)
 
     def on_api_get(self, request):
         """Return the current state of the display.
+
+        The optional `format` query parameter selects the frame format:
+        'png' (the default) or 'raw'.
+
+        If the `since` query parameter is given, the request waits
+        until there is a frame with a different version, for up to
+        `timeout` seconds (at most VP_MAX_WAIT, which is also the
+        default). The current frame is returned either way, so clients
+        can tell by its version whether it is new.
+
+        """
+        format = request.args.get('format', 'png')
+        if format not in FRAME_ENCODERS:
+            return flask.abort(400, f"{format} is not a valid frame format")
+        since = request.args.get('since', type=int)
+        if since is not None:
+            timeout = request.args.get('timeout', self.VP_MAX_WAIT, type=float)
+            if not math.isfinite(timeout):
+                return flask.abort(400, "timeout must be a number of seconds")
+            self.vp_wait_for_frame(since, min(max(timeout, 0), self.VP_MAX_WAIT))
+        return self.vp_frame_response(format)
+
+    def vp_frame_response(self, format):
+        """Build the API response for the current frame.
         """
-        return flask.jsonify(image_data=self._VP_ACTIVE_COMM['image_data'])
+        if format not in FRAME_ENCODERS:
+            return flask.abort(400, f"{format} is not a valid frame format")
+        return flask.jsonify(self.vp_get_frame(format))
 
     # ~ AssetPlugin
     
@@ -101,10 +296,16 @@ class VirtualPanel:
         VirtualPanelMixin.vp_register_callback(button_callback)
         self.width = width
         self.height = height
+        self.rotated = False
         self._hold_image = None
         self.fill(0)
         self.show()
 
+    def setup(self, settings):
+        """Apply settings from OctoPrint's SettingsPlugin mixin.
+        """
+        self.rotated = settings.get_boolean(['image_rotate'], merged=True)
+
     def shutdown(self):
         pass # not needed
 
@@ -139,6 +340,10 @@ class VirtualPanel:
     def image(self, img):
         """Set a new image to be shown on the virtual panel.
         """
+        if self.rotated:
+            started = METRICS.start()
+            img = rotate_180(img)
+            METRICS.stop('virtual_panel.rotate', started)
         if self._hold_image is None:
             self._image = img
         else:
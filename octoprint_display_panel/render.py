@@ -0,0 +1,348 @@
+"""Background rendering of Micro Panel frames.
+
+Redraws are requested from many threads: OctoPrint's event dispatch,
+the GPIO button callbacks and the progress hook. Rendering a frame on
+each of those threads would let frames race each other onto the I2C
+bus and stall the calling thread (and with it, every other plugin
+waiting on the same event dispatch) for the duration of the transfer.
+Instead, callers only flag that a redraw is needed and a single worker
+thread renders the frames.
+
+Screens showing time-dependent content don't need to be redrawn on a
+fixed period either: after each frame, the worker asks when the
+screens shown next go stale, and sleeps until exactly then.
+
+Button presses are queued for the worker too, along with the time of
+the button edge, so that the thread reporting them (such as RPi.GPIO's
+callback thread) is free for the next press right away. The worker
+handles queued presses before anything else, and draws their result
+without waiting for the frame rate limits.
+
+"""
+import threading
+import time
+from collections import deque
+from octoprint.util import monotonic_time
+
+from .metrics import METRICS
+
+import logging
+logger = logging.getLogger("octoprint.plugins.display_panel.render")
+
+
+class RenderWorker:
+    """A dedicated thread that renders frames on request.
+
+    Calling `request()` returns immediately. All requests that arrive
+    while a frame is already pending are coalesced into that frame,
+    and frames are rendered at most `max_fps` times per second.
+
+    Requests from high-frequency sources (such as printer events) can
+    be governed: a frame requested only by those is held back until
+    `event_interval` seconds after the last one. The held back frame is
+    always rendered in the end, so the latest state gets drawn.
+    Immediate requests (such as button presses) are rendered right
+    away, bypassing both limits.
+
+    If given, `next_refresh` is called after each frame and returns
+    the time (on the `time.time()` clock) at which another frame is
+    needed without being requested, or None.
+
+    While the display is off, rendering can be suspended; requests
+    made meanwhile, and the refreshes that would have been scheduled,
+    are only counted, as `avoided`.
+
+    Button presses given to `press()` are passed to `handle_press`,
+    which returns whether the press needs a redraw. The frame drawn for
+    a press is rendered by calling `render(pressed_at=...)` with the
+    time of the earliest press it shows, so that it can be followed to
+    the display.
+
+    """
+    # The longest the worker sleeps before checking the time of the
+    # next refresh again, in case the clock was changed
+    MAX_SLEEP = 60
+
+    # The most button presses kept waiting to be handled
+    MAX_PRESSES = 16
+
+    # While suspended, the refreshes the screens would have needed are
+    # counted as if they kept coming at the pace of the last one, but
+    # no more often than this many seconds
+    MIN_REFRESH_PERIOD = 1.0
+
+    def __init__(self, render, max_fps=10, next_refresh=None,
+                 event_interval=0, handle_press=None):
+        self.render = render
+        self.next_refresh = next_refresh
+        self.handle_press = handle_press
+        self._presses = deque(maxlen=self.MAX_PRESSES)
+        self._refresh_at = None
+        self._refresh_period = None
+        self.set_max_fps(max_fps)
+        self.set_event_interval(event_interval)
+        self._cond = threading.Condition()
+        self._pending = False
+        self._pending_interval = None
+        self._requested_at = None
+        self._last_render = None
+        self._running = False
+        self._suspended = False
+        self._rendering = False
+        self._thread = None
+        self.stats = {
+            'requests': 0,
+            'coalesced': 0,
+            'suppressed': 0,
+            'immediate': 0,
+            'scheduled': 0,
+            'avoided': 0,
+            'presses': 0,
+            'presses_dropped': 0,
+            'frames': 0,
+            'latency_last': 0.0,
+            'latency_max': 0.0,
+            'latency_total': 0.0,
+        }
+
+    def set_max_fps(self, max_fps):
+        """Change the maximum frame rate; 0 disables the limit.
+        """
+        self.min_interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+
+    def set_event_interval(self, interval):
+        """Change the minimum time between frames requested only by
+        governed requests; 0 disables the governor.
+        """
+        self.event_interval = max(interval or 0.0, 0.0)
+
+    def start(self):
+        """Start the worker thread, if it is not already running.
+        """
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run,
+                                        name="DisplayPanelRender",
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker thread, waiting for any frame in progress.
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def request(self, immediate=False, governed=False):
+        """Request that a new frame be rendered.
+
+        An `immediate` frame is rendered right away; a `governed` one
+        is subject to the event interval.
+
+        """
+        if immediate:
+            interval = 0.0
+        elif governed:
+            interval = max(self.min_interval, self.event_interval)
+        else:
+            interval = self.min_interval
+
+        with self._cond:
+            self.stats['requests'] += 1
+            if self._suspended:
+                self.stats['avoided'] += 1
+                return
+            if immediate:
+                self.stats['immediate'] += 1
+            if self._pending:
+                self.stats['coalesced'] += 1
+                if governed:
+                    self.stats['suppressed'] += 1
+                if interval < self._pending_interval:
+                    self._pending_interval = interval
+                    self._cond.notify_all()
+                return
+            self._pending = True
+            self._pending_interval = interval
+            self._requested_at = monotonic_time()
+            self._cond.notify_all()
+
+    def press(self, label, pressed_at=None):
+        """Queue a button press, to be handled before anything else.
+
+        `pressed_at` is the time of the button edge, on the
+        `monotonic_time()` clock; it defaults to now.
+
+        Returns whether the press was queued, which it is not while
+        the worker isn't running.
+
+        """
+        if pressed_at is None:
+            pressed_at = monotonic_time()
+        with self._cond:
+            if not self._running:
+                return False
+            self.stats['presses'] += 1
+            if len(self._presses) == self._presses.maxlen:
+                self.stats['presses_dropped'] += 1
+            self._presses.append((label, pressed_at))
+            self._cond.notify_all()
+        return True
+
+    def suspend(self, timeout=5):
+        """Stop rendering frames until `resume()` is called.
+
+        Waits for a frame in progress to finish, so no frame is pushed
+        after this returns (unless called from the worker thread).
+
+        """
+        with self._cond:
+            self._suspended = True
+            self._pending = False
+            if threading.current_thread() is not self._thread:
+                self._cond.wait_for(lambda: not self._rendering, timeout)
+
+    def resume(self):
+        """Resume rendering, starting with one fresh frame.
+        """
+        with self._cond:
+            if not self._suspended:
+                return
+            self._suspended = False
+            self._pending = True
+            self._pending_interval = 0.0
+            self._requested_at = monotonic_time()
+            self._cond.notify_all()
+
+    @property
+    def suspended(self):
+        return self._suspended
+
+    @property
+    def queue_depth(self):
+        """The number of frames waiting to be rendered (either 0 or 1).
+        """
+        return 1 if self._pending else 0
+
+    def get_stats(self):
+        """Return a snapshot of the worker's counters.
+        """
+        with self._cond:
+            stats = dict(self.stats)
+            stats['queue_depth'] = self.queue_depth
+            stats['presses_queued'] = len(self._presses)
+        frames = stats['frames']
+        stats['latency_avg'] = stats['latency_total'] / frames if frames else 0.0
+        return stats
+
+    def _handle_presses(self, presses):
+        """Handle queued button presses, and return the time of the
+        earliest one that needs a redraw, or None.
+        """
+        pressed_at = None
+        for label, at in presses:
+            try:
+                redraw = self.handle_press(label)
+            except Exception:
+                logger.exception(f"Failed to handle button {label}")
+                continue
+            if redraw and (pressed_at is None or at < pressed_at):
+                pressed_at = at
+        return pressed_at
+
+    def _run(self):
+        while True:
+            with self._cond:
+                presses = list(self._presses)
+                self._presses.clear()
+
+            # Button presses come first, and their frame is rendered
+            # right away. Any frame pending is drawn along with it.
+            pressed_at = None
+            if presses and self.handle_press is not None:
+                pressed_at = self._handle_presses(presses)
+
+            with self._cond:
+                if pressed_at is not None and not self._suspended:
+                    self._pending = True
+                    self._pending_interval = 0.0
+                    self._requested_at = pressed_at
+                else:
+                    pressed_at = None
+
+                while (self._running and not self._presses
+                       and (self._suspended or not self._pending)):
+                    if self._refresh_at is None:
+                        self._cond.wait()
+                        continue
+                    delay = self._refresh_at - time.time()
+                    if delay <= 0 and self._suspended:
+                        self.stats['avoided'] += 1
+                        self._refresh_at = (time.time() + self._refresh_period
+                                            if self._refresh_period else None)
+                        continue
+                    if delay <= 0:
+                        self._pending = True
+                        self._pending_interval = self.min_interval
+                        self._requested_at = monotonic_time()
+                        self.stats['scheduled'] += 1
+                        break
+                    self._cond.wait(min(delay, self.MAX_SLEEP))
+                if not self._running:
+                    return
+                if self._presses and pressed_at is None:
+                    continue
+
+                # Hold the frame back until the frame rate (or, for
+                # governed requests, the event interval) allows it;
+                # requests arriving in the meantime are coalesced.
+                if self._last_render is not None:
+                    delay = (self._last_render + self._pending_interval
+                             - monotonic_time())
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+
+                self._pending = False
+                self._rendering = True
+                requested_at = self._requested_at
+
+            started = monotonic_time()
+            try:
+                if pressed_at is None:
+                    self.render()
+                else:
+                    self.render(pressed_at=pressed_at)
+            except Exception:
+                logger.exception("Failed to render frame")
+            finished = monotonic_time()
+            self._last_render = started
+
+            refresh_at = None
+            if self.next_refresh is not None:
+                try:
+                    refresh_at = self.next_refresh()
+                except Exception:
+                    logger.exception("Failed to get the next refresh time")
+
+            latency = finished - requested_at
+            METRICS.record('render_worker.latency', latency)
+            if pressed_at is not None:
+                METRICS.record('render_worker.press_latency', latency)
+            with self._cond:
+                self._rendering = False
+                self._cond.notify_all()
+                self._refresh_at = refresh_at
+                self._refresh_period = (
+                    max(refresh_at - time.time(), self.MIN_REFRESH_PERIOD)
+                    if refresh_at is not None else None)
+                self.stats['frames'] += 1
+                self.stats['latency_last'] = latency
+                self.stats['latency_max'] = max(self.stats['latency_max'],
+                                                latency)
+                self.stats['latency_total'] += latency
@@ -54,10 +54,24 @@ class MicroPanelScreenTop(base.MicroPanelScreenBase):
         self.status_bar_screen = printer.PrinterStatusBarScreen(
             width, self.status_bar_height, self._printer, self._settings)
 
+        # All screens draw directly into their region of one shared
+        # framebuffer, so no compositing is needed to build a frame.
+        self.subscreen_height = height - self.status_bar_height
+        if self.status_bar_top == 0:
+            main_top = self.status_bar_height
+        else:
+            main_top = 0
+        self._canvas = base.MicroPanelCanvas(width, height)
+        self.main_view = self._canvas.view(0, main_top,
+                                           width, self.subscreen_height)
+        self.status_bar_screen.bind_canvas(
+            self._canvas.view(0, self.status_bar_top,
+                              width, self.status_bar_height))
+        self._frame_key = None
+
         # Define the main set of subscreens. These screens will be
         # rotated through via the 'mode' button in the order they are
         # listed below.
-        self.subscreen_height = height - self.status_bar_height
         self.screens = {
             'system': system.SystemInfoScreen(width, self.subscreen_height),
             'printer': printer.PrinterInfoScreen(width, self.subscreen_height,
@@ -91,6 +105,11 @@ class MicroPanelScreenTop(base.MicroPanelScreenBase):
             screen = self.screens[screen]
         super().set_subscreen(screen)
 
+    def subscreen_canvas(self, screen):
+        """Subscreens draw into the region not taken by the status bar.
+        """
+        return self.main_view
+
     def next_subscreen(self):
         """Rotate to the next subscreen in the set of screens.
         """
@@ -99,26 +118,60 @@ class MicroPanelScreenTop(base.MicroPanelScreenBase):
         i = (i + 1) % len(screen_list)
         self.set_subscreen(screen_list[i])
         
+    def set_visible(self, visible):
+        """Notify the status bar and the subscreen whether they are shown.
+        """
+        super().set_visible(visible)
+        self.status_bar_screen.set_visible(visible)
+
+    def invalidate(self):
+        """Discard the cached images of this screen and all its parts.
+        """
+        super().invalidate()
+        self.status_bar_screen.invalidate()
+        for screen in self.screens.values():
+            screen.invalidate()
+        if self.subscreen is not None:
+            self.subscreen.invalidate()
+
     @property
     def image(self):
-        """Render this screen by combining the status bar and the subscreen.
+        """Render this screen by bringing the status bar and the subscreen
+        up to date.
+
+        Both draw straight into the shared framebuffer, which is
+        returned as is. It gets a new frame id only if either of them
+        was redrawn.
+
         """
-        if self.status_bar_top == 0:
-            main_top = self.status_bar_height
-        else:
-            main_top = 0
-            
-        c = self.get_canvas()
-        main_image = super().image
-        c.image.paste(main_image, (0, main_top))
-        if main_image.size[1] < self.height:
-            c.image.paste(self.status_bar_screen.image,
-                          (0, self.status_bar_top))
-        return c.image
+        with self._printer.snapshot():
+            super().image
+            self.status_bar_screen.image
+            key = (self.frame_id, self.status_bar_screen.frame_id)
+
+        if key != self._frame_key:
+            self._frame_key = key
+            self._frame_id = base.new_frame_id()
+        self.frame_id = self._frame_id
+        return self._canvas.image
+
+    @property
+    def next_refresh(self):
+        """The earliest time at which the status bar or the subscreen
+        goes stale.
+        """
+        times = [t for t in (super().next_refresh,
+                             self.status_bar_screen.next_refresh)
+                 if t is not None]
+        return min(times) if times else None
 
     def handle_button(self, label):
         """Take action on a button press, if not handled by the subscreen.
         """
+        with self._printer.snapshot():
+            return self._handle_button(label)
+
+    def _handle_button(self, label):
         if label == 'mode':
             self.next_subscreen()
             return {'DRAW'}
@@ -180,6 +233,16 @@ class MicroPanelScreenTop(base.MicroPanelScreenBase):
 
         return {'DRAW'}
 
+    def event_routes(self):
+        """Add the events of the status bar and the print status screen,
+        which get events even when not shown.
+        """
+        routes = super().event_routes()
+        for screen in (self.status_bar_screen, self.screens['print']):
+            for event, screens in screen.event_routes().items():
+                routes.setdefault(event, set()).update(screens)
+        return routes
+
     def process_event(self, event, payload):
         """Distribute all incoming events.
 
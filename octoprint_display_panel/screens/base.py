@@ -12,14 +12,38 @@ method:
 
 Note the use of `get_canvas()`, which returns an instance of
 MicroPanelCanvas which can make certain routine drawing operations
-(primarily text) easier.
+(primarily text) easier. Each screen has a single canvas, which is
+cleared and reused every time the screen is drawn, so the returned
+image should be treated as belonging to the screen. A subscreen's
+canvas is a view of its region of the parent's canvas, so the whole
+display is drawn into one shared framebuffer; only `get_canvas()`
+coordinates and the returned image's contents within that region
+should be relied upon.
 
 Screens are drawn whenever the plugin core determines they need to be
-drawn; typically, no less frequently than every 5 seconds, but can be
-arbitrarily often. If your screen's data changes based on printer
-events, for example, you should implement the `handle_event()` method
-and the `EVENTS` list, and return a set including the string 'DRAW' to
-signal that your screen is ready to be redrawn.
+drawn, which can be arbitrarily often. The image returned by `draw()`
+is reused until the screen is invalidated, so if your screen's data
+changes based on printer events, for example, you should implement
+the `handle_event()` method and the `EVENTS` list, and return a set
+including the string 'DRAW' to signal that your screen is ready to be
+redrawn. Screens showing time-dependent content should instead
+implement `refresh_at()`, returning the time at which the image just
+drawn goes stale; the plugin core redraws the visible screens at
+exactly that time, and not before:
+
+  class ClockScreen(base.MicroPanelScreenBase):
+      def draw(self):
+          c = self.get_canvas()
+          c.text_centered(0, time.strftime("%H:%M:%S"))
+          return c.image
+
+      def refresh_at(self, now):
+          return base.next_boundary(1, now)
+
+Screens that only need to be redrawn every so often can set `MAX_AGE`
+to the number of seconds their image stays current instead.
+
+A screen can also be invalidated explicitly by calling `invalidate()`.
 
   class EventScreen(base.MicroPanelScreenBase):
       def __init__(self, *args, **kwargs):
@@ -67,12 +91,106 @@ method. Subscreens will stay active until they return the value
 
 """
 
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
 from PIL import Image, ImageDraw, ImageFont
 
 
 DEFAULT_FONT = ImageFont.load_default()
 DEFAULT_FONT_LINE_HEIGHT = 9
 
+# Every image drawn by any screen gets a unique id, which lets a screen
+# composed of other screens tell whether any of its parts changed.
+_frame_ids = itertools.count(1)
+
+
+def new_frame_id():
+    """Return a new, unique frame id.
+    """
+    return next(_frame_ids)
+
+
+# Changes whenever a subscreen is set anywhere, so that anything
+# derived from the shape of the screen tree (such as the plugin's
+# event routes) can tell when it needs to be rebuilt
+tree_version = 0
+
+
+class TextCache:
+    """A bounded LRU cache of rasterized text.
+
+    Screens draw the same strings over and over, and measuring and
+    rasterizing them each time is a large part of drawing a screen.
+    For each (font, text) pair, this cache keeps the text's size and
+    a 1-bit mask of its glyphs, so that drawing it again is a single
+    paste. The mask doesn't depend on the fill color, so it isn't part
+    of the key. A `maxsize` of 0 disables the cache.
+
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._draw = ImageDraw.Draw(Image.new("1", (1, 1)))
+
+    def resize(self, maxsize):
+        """Change the maximum number of entries, evicting as needed.
+        """
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+    def get(self, font, text):
+        """Return the (size, mask) of a single line of text.
+        """
+        key = (font, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+
+        size = self._draw.textsize(text, font=font)
+        mask = Image.new("1", size)
+        ImageDraw.Draw(mask).text((0, 0), text, font=font, fill=255)
+        entry = (size, mask)
+
+        with self._lock:
+            if self.maxsize > 0:
+                self._entries[key] = entry
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+# Shared by all canvases
+TEXT_CACHE = TextCache()
+
+
+# ImageDraw methods whose first argument holds coordinates, which
+# need to be offset when drawing on a view
+OFFSET_METHODS = frozenset([
+    'arc', 'bitmap', 'chord', 'ellipse', 'line', 'multiline_text',
+    'multiline_textbbox', 'pieslice', 'point', 'polygon', 'rectangle',
+    'rounded_rectangle', 'text', 'textbbox',
+])
+
+# Those of them that only measure, rather than draw
+MEASURE_METHODS = frozenset(['multiline_textbbox', 'textbbox'])
+
 
 class MicroPanelCanvas:
     """Helper class for providing a pre-initialized drawing surface for screens.
@@ -82,11 +200,43 @@ class MicroPanelCanvas:
     other methods available from the ImageDraw.Draw class. Drawn image
     data can be retrieved by the `image` instance variable.
 
+    A canvas can also be a view of a region of another canvas, created
+    with `view()`. A view draws directly into the image of the canvas
+    it was created from, with coordinates relative to the region's
+    top left corner, and everything drawn on it is clipped to the
+    region.
+
     """
-    def __init__(self, width, height):
+    def __init__(self, width, height, image=None, origin=(0, 0)):
         self.width, self.height = width, height
-        self.image = Image.new("1", (self.width, self.height))
+        if image is None:
+            image = Image.new("1", (self.width, self.height))
+        self.image = image
+        self.origin = origin
         self.draw = ImageDraw.Draw(self.image)
+        # Whether drawing has to be clipped to a region of the image
+        self.clipped = self.box != (0, 0) + self.image.size
+
+    def view(self, x, y, width, height):
+        """Return a canvas for a region of this canvas.
+
+        The region is limited to the bounds of this canvas.
+
+        """
+        width = max(min(width, self.width - x), 0)
+        height = max(min(height, self.height - y), 0)
+        view = MicroPanelCanvas(width, height, self.image,
+                                (self.origin[0] + x, self.origin[1] + y))
+        view.draw = self.draw
+        return view
+
+    @property
+    def box(self):
+        """The (left, top, right, bottom) bounds of this canvas within
+        its image.
+        """
+        left, top = self.origin
+        return (left, top, left + self.width, top + self.height)
 
     def fill(self, color):
         """Fill the entire canvas with the specified color.
@@ -94,7 +244,39 @@ class MicroPanelCanvas:
         Typical colors: 0=black, 255=white
 
         """
-        self.rectangle((0, 0, self.width, self.height), fill=color)
+        self.image.paste(color, self.box)
+
+    def offset(self, xy):
+        """Translate coordinates relative to this canvas into coordinates
+        of its image.
+
+        Accepts any of the forms ImageDraw takes: a sequence of (x, y)
+        pairs or a flat sequence of x, y values.
+
+        """
+        dx, dy = self.origin
+        if not (dx or dy):
+            return xy
+        if xy and isinstance(xy[0], (tuple, list)):
+            return [(x + dx, y + dy) for x, y in xy]
+        return [v + (dy if i % 2 else dx) for i, v in enumerate(xy)]
+
+    def paste_mask(self, color, point, mask):
+        """Fill the pixels set in a 1-bit mask with a color, with the
+        mask's top left corner at the given point, clipped to this
+        canvas.
+        """
+        x, y = self.offset(point)
+        width, height = mask.size
+        left, top, right, bottom = self.box
+        box = (max(x, left), max(y, top),
+               min(x + width, right), min(y + height, bottom))
+        if box[0] >= box[2] or box[1] >= box[3]:
+            return
+        if box != (x, y, x + width, y + height):
+            mask = mask.crop((box[0] - x, box[1] - y,
+                              box[2] - x, box[3] - y))
+        self.image.paste(color, box, mask)
 
     def text(self, point, message, **kwargs):
         """Draw text at a point on the canvas.
@@ -106,7 +288,20 @@ class MicroPanelCanvas:
         """
         kwargs.setdefault('font', DEFAULT_FONT)
         kwargs.setdefault('fill', 255)
-        self.draw.text(point, message, **kwargs)
+        if (len(kwargs) == 2 and '\n' not in message
+            and TEXT_CACHE.maxsize > 0):
+            size, mask = TEXT_CACHE.get(kwargs['font'], message)
+            self.paste_mask(kwargs['fill'],
+                            (int(point[0]), int(point[1])), mask)
+        else:
+            self.draw_method('text')(point, message, **kwargs)
+
+    def text_size(self, message, font=DEFAULT_FONT):
+        """Return the (width, height) of the text when drawn.
+        """
+        if '\n' not in message and TEXT_CACHE.maxsize > 0:
+            return TEXT_CACHE.get(font, message)[0]
+        return self.textsize(message, font=font)
 
     def text_right(self, y, message, **kwargs):
         """Draw text, right aligned, at the given position on the canvas.
@@ -118,7 +313,6 @@ class MicroPanelCanvas:
 
         """
         kwargs.setdefault('font', DEFAULT_FONT)
-        text_size = self.textsize(message, font=kwargs['font'])
         if '\n' in message:
             lines = message.rstrip('\n').split('\n')
             if kwargs['font'] == DEFAULT_FONT:
@@ -126,10 +320,12 @@ class MicroPanelCanvas:
             elif 'line_height' in kwargs:
                 line_height = kwargs['line_height']
             else:
+                text_size = self.text_size(message, font=kwargs['font'])
                 line_height = text_size[1] / len(lines)
             for i, line in enumerate(message.rstrip('\n').split('\n')):
                 self.text_right(y + (i * line_height), line, **kwargs)
         else:
+            text_size = self.text_size(message, font=kwargs['font'])
             x = self.width - text_size[0]
             self.text((x, y), message, **kwargs)
         
@@ -143,7 +339,6 @@ class MicroPanelCanvas:
 
         """
         kwargs.setdefault('font', DEFAULT_FONT)
-        text_size = self.textsize(message, font=kwargs['font'])
         if '\n' in message:
             lines = message.rstrip('\n').split('\n')
             if kwargs['font'] == DEFAULT_FONT:
@@ -151,20 +346,102 @@ class MicroPanelCanvas:
             elif 'line_height' in kwargs:
                 line_height = kwargs['line_height']
             else:
+                text_size = self.text_size(message, font=kwargs['font'])
                 line_height = text_size[1] / len(lines)
             for i, line in enumerate(message.rstrip('\n').split('\n')):
                 self.text_centered(y + (i * line_height), line, **kwargs)
         else:
+            text_size = self.text_size(message, font=kwargs['font'])
             x = (self.width / 2) - (text_size[0] / 2)
             self.text((x, y), message, **kwargs)
         
     def __getattr__(self, key):
         """Proxy any other attributes (methods) to the canvas draw instance.
         """
-        return getattr(self.draw, key)
+        return self.draw_method(key)
+
+    def draw_method(self, key):
+        """Return a method of the canvas draw instance that takes
+        coordinates relative to this canvas.
+
+        On a view, anything that may reach outside of the view's region
+        is drawn onto a copy of the region, which is then pasted back,
+        so that nothing is drawn outside of it.
+
+        """
+        attr = getattr(self.draw, key)
+        if key not in OFFSET_METHODS:
+            return attr
+        if key in MEASURE_METHODS or not self.clipped:
+            if self.origin == (0, 0):
+                return attr
+
+            def offset_method(xy, *args, **kwargs):
+                return attr(self.offset(xy), *args, **kwargs)
+            return offset_method
+
+        def clipped_method(xy, *args, **kwargs):
+            if self.contains(key, xy, args, kwargs):
+                if self.origin == (0, 0):
+                    return attr(xy, *args, **kwargs)
+                return attr(self.offset(xy), *args, **kwargs)
+            box = self.box
+            region = self.image.crop(box)
+            result = getattr(ImageDraw.Draw(region), key)(xy, *args, **kwargs)
+            self.image.paste(region, box)
+            return result
+        return clipped_method
+
+    def contains(self, key, xy, args, kwargs):
+        """Return whether a drawing operation stays within this canvas.
+
+        Text could reach anywhere, so it never counts as contained.
+        Outlines and lines are allowed their full width on every side.
+
+        """
+        if key in ('text', 'multiline_text'):
+            return False
+        if not xy:
+            return True
+        if isinstance(xy[0], (tuple, list)):
+            xs, ys = zip(*xy)
+        else:
+            xs, ys = xy[0::2], xy[1::2]
+        if key == 'bitmap':
+            bitmap = args[0] if args else kwargs['bitmap']
+            xs = (xs[0], xs[0] + bitmap.width - 1)
+            ys = (ys[0], ys[0] + bitmap.height - 1)
+        margin = kwargs.get('width') or 1
+        return (min(xs) >= margin - 1 and min(ys) >= margin - 1
+                and max(xs) + margin <= self.width
+                and max(ys) + margin <= self.height)
+
+
+def next_boundary(period, now=None, offset=0.0):
+    """Return the first time after `now` that is a whole number of
+    `period` seconds past `offset`.
+
+    For example, `next_boundary(60, now)` is the start of the next
+    minute (in UTC).
+
+    """
+    if now is None:
+        now = time.time()
+    return (math.floor((now - offset) / period) + 1) * period + offset
 
 
 class MicroPanelScreenBase:
+    # The number of seconds a drawn image is reused for before the
+    # screen is redrawn, unless `refresh_at()` is overridden. None
+    # means the image is reused until the screen is invalidated.
+    MAX_AGE = None
+
+    # True while the screen is part of what's shown on the display
+    visible = False
+
+    # The canvas this screen draws into, see `canvas`
+    _canvas = None
+
     def __init__(self, width, height):
         """Initialize the base screen.
         
@@ -174,6 +451,9 @@ class MicroPanelScreenBase:
         """
         self.width = width
         self.height = height
+        self.frame_id = 0
+        self._image = None
+        self._stale_at = None
         self.subscreen = None
 
     def draw(self):
@@ -221,18 +501,103 @@ class MicroPanelScreenBase:
         or button handlers return a value 'BACK'.
 
         """
+        global tree_version
+        old = getattr(self, 'subscreen', None)
+        if old is not None and old is not screen:
+            old.set_visible(False)
         self.subscreen = screen
-        
+        tree_version += 1
+        if screen is not None:
+            screen.bind_canvas(self.subscreen_canvas(screen))
+            screen.set_visible(self.visible)
+        # Screens that aren't shown don't receive events, so whichever
+        # screen is shown now needs to be drawn fresh.
+        (screen if screen is not None else self).invalidate()
+
+    def set_visible(self, visible):
+        """Notify this screen, and its subscreen, whether it is shown.
+
+        Subclasses can override this to only do background work while
+        they are visible, but should call this function as well.
+
+        """
+        self.visible = visible
+        if self.subscreen is not None:
+            self.subscreen.set_visible(visible)
+
+    def invalidate(self):
+        """Discard the cached image, so that the screen is redrawn the
+        next time its image is requested.
+        """
+        self._image = None
+
+    def refresh_at(self, now):
+        """Return the time at which the image drawn at `now` goes stale.
+
+        Times are on the `time.time()` clock. None means the image
+        stays current until the screen is invalidated. This is called
+        right after each draw, and should be overridden by screens
+        showing time-dependent content.
+
+        """
+        if self.MAX_AGE is None:
+            return None
+        return now + self.MAX_AGE
+
+    @property
+    def is_stale(self):
+        """True if the cached image needs to be redrawn.
+        """
+        if self._image is None:
+            return True
+        return self._stale_at is not None and time.time() >= self._stale_at
+
+    @property
+    def next_refresh(self):
+        """The time at which what this screen shows goes stale, or None
+        if that only happens when it is invalidated.
+        """
+        if self.subscreen is not None:
+            return self.subscreen.next_refresh
+        if self._image is None:
+            return time.time()
+        return self._stale_at
+
     @property
     def image(self):
         """Draw the current subscreen, or screen, and return its image.
+
+        The screen's image is only drawn if the cached image is
+        stale. The `frame_id` of the returned image is stored in
+        `self.frame_id`.
+
         """
         if self.subscreen is not None:
             img = self.subscreen.image
             if img:
+                self.frame_id = self.subscreen.frame_id
                 return img
-        return self.draw()
+        if self.is_stale:
+            now = time.time()
+            self._image = self.draw()
+            self._stale_at = self.refresh_at(now)
+            self.frame_id = new_frame_id()
+        return self._image
         
+    def event_routes(self):
+        """Return the events processed by this screen and its subscreen,
+        as a dict of event names to the sets of screens handling them.
+        """
+        routes = {}
+        for event in self.EVENTS:
+            routes.setdefault(event, set()).add(self)
+        if self.subscreen is not None:
+            # The subscreen only gets the events it wants itself
+            for event, screens in self.subscreen.event_routes().items():
+                if self.subscreen.wants_event(event):
+                    routes.setdefault(event, set()).update(screens)
+        return routes
+
     def process_event(self, event, payload):
         """Process an incoming event for this screen and its subscreen.
         
@@ -249,12 +614,15 @@ class MicroPanelScreenBase:
 
         # The subscreen wants to cancel itself
         if 'BACK' in r:
-            self.subscreen = None
+            self.set_subscreen(None)
             r.remove('BACK')
             r.add('DRAW')
                 
         if self.wants_event(event):
-            r.update(self.handle_event(event, payload) or set())
+            result = self.handle_event(event, payload) or set()
+            if 'DRAW' in result:
+                self.invalidate()
+            r.update(result)
 
         return r
 
@@ -271,17 +639,49 @@ class MicroPanelScreenBase:
             r.update(self.subscreen.process_button(label))
 
         if 'BACK' in r:
-            self.subscreen = None
+            self.set_subscreen(None)
             r.remove('BACK')
             r.add('DRAW')
         elif not r:
             # We only handle the button press ourselves if the
             # subscreen didn't handle it (by returning a value)
-            r.update(self.handle_button(label) or set())
+            result = self.handle_button(label) or set()
+            if 'DRAW' in result:
+                self.invalidate()
+            r.update(result)
             
         return r
 
+    @property
+    def canvas(self):
+        """The canvas this screen draws into.
+
+        Unless the screen has been bound to a canvas of its parent
+        screen, it gets a canvas of its own on first use.
+
+        """
+        if self._canvas is None:
+            self._canvas = MicroPanelCanvas(self.width, self.height)
+        return self._canvas
+
+    def bind_canvas(self, canvas):
+        """Draw this screen into the given canvas (typically a view of
+        the parent screen's canvas) from now on.
+        """
+        self._canvas = canvas
+        self.invalidate()
+
+    def subscreen_canvas(self, screen):
+        """Return the canvas a subscreen of this screen should draw into.
+
+        By default, the subscreen draws over this screen's contents.
+
+        """
+        return self.canvas.view(0, 0, screen.width, screen.height)
+
     def get_canvas(self):
-        """Create a new canvas instance for drawing a screen.
+        """Return this screen's canvas, cleared for drawing.
         """
-        return MicroPanelCanvas(self.width, self.height)
+        c = self.canvas
+        c.fill(0)
+        return c
@@ -1,7 +1,9 @@
 """Printer-centric Micro Panel screens.
 """
+import math
 import time
 import threading
+from contextlib import contextmanager
 from octoprint.events import Events, eventManager
 from octoprint.util import monotonic_time
 
@@ -18,32 +20,91 @@ class PrinterHelper:
     instance variable, so for most purposes it can be treated
     equivalently to the `_printer` instance.
 
+    Each call to `get_current_data()` makes OctoPrint deep-copy its
+    state under a lock, and drawing a single frame needs that data
+    many times over. Within a `snapshot()` block, the printer is only
+    queried once for its current data, temperatures and connection,
+    and all screens drawn in the block share the result:
+
+      with helper.snapshot():
+          image = top_screen.image
+
     """
     def __init__(self, _printer):
         self._printer = _printer
+        self._local = threading.local()
+        self.stats = {
+            'printer_calls': 0,
+            'snapshots': 0,
+            'last_snapshot_calls': 0,
+        }
 
     def __getattr__(self, key):
         if self._printer:
             return getattr(self._printer, key)
 
+    @contextmanager
+    def snapshot(self):
+        """Share one query of the printer's state within this block.
+
+        Snapshots are per thread; nested snapshots share the outermost
+        one.
+
+        """
+        if getattr(self._local, 'cache', None) is not None:
+            yield
+            return
+
+        self._local.cache = {}
+        self._local.calls = 0
+        try:
+            yield
+        finally:
+            self.stats['snapshots'] += 1
+            self.stats['last_snapshot_calls'] = self._local.calls
+            self._local.cache = None
+
+    def _query(self, method):
+        """Call a printer method, or return its result from the snapshot.
+        """
+        cache = getattr(self._local, 'cache', None)
+        if cache is not None:
+            if method in cache:
+                return cache[method]
+            self._local.calls += 1
+        self.stats['printer_calls'] += 1
+        result = getattr(self._printer, method)()
+        if cache is not None:
+            cache[method] = result
+        return result
+
+    def get_current_data(self):
+        return self._query('get_current_data')
+
+    def get_current_temperatures(self):
+        return self._query('get_current_temperatures')
+
+    def get_current_connection(self):
+        return self._query('get_current_connection')
+
     # Helper methods
 
     @property
     def flags(self):
-        return self._printer.get_current_data()['state']['flags']
+        return self.get_current_data()['state']['flags']
 
     @property
     def progress(self):
-        return self._printer.get_current_data()['progress']
+        return self.get_current_data()['progress']
 
     @property
     def job(self):
-        return self._printer.get_current_data()['job']
+        return self.get_current_data()['job']
 
     def is_disconnected(self):
         if self._printer is None:
             return True
-        return self._printer.get_current_connection()[0] == 'Closed'
+        return self.get_current_connection()[0] == 'Closed'
         
 
 def get_time_from_seconds(seconds):
@@ -63,6 +124,17 @@ def get_time_from_seconds(seconds):
     return f"{hours:02d}h {minutes:02d}m {seconds:02d}s"
     
 
+def strftime_resolution(format):
+    """Return the number of seconds between changes of a time formatted
+    with `time.strftime(format)`, at most an hour.
+    """
+    if any(d in format for d in ('%S', '%s', '%T', '%X', '%c', '%r')):
+        return 1
+    if any(d in format for d in ('%M', '%R')):
+        return 60
+    return 3600
+
+
 def float_count_formatter(number, max_chars):
     """Show decimals up to length max_chars, then rounds to integer
     """
@@ -76,18 +148,33 @@ def float_count_formatter(number, max_chars):
 class PrinterInfoScreen(base.MicroPanelScreenBase):
     """Base Information about the printer (temperatures)
     """
+    # Temperatures change without any event being fired; OctoPrint
+    # polls them every 2 seconds while heating
+    MAX_AGE = 2
+
+    # Below this temperature (in degrees C), a heater that has no target
+    # is taken to be at room temperature, where it stays
+    COOL_TEMPERATURE = 40
+
     def __init__(self, width, height, _printer):
         super().__init__(width, height)
         self._printer = _printer
+        self._changing = False
         
     def draw(self):
         c = self.get_canvas()
         c.text((0, 0), "Printer Temperatures")
         head_text = "no printer"
         bed_text = "no printer"
+        self._changing = False
         
         if not self._printer.is_disconnected():
             temperatures = self._printer.get_current_temperatures()
+            self._changing = any(
+                (heater.get('target') or 0) > 0
+                or (heater.get('actual') or 0) >= self.COOL_TEMPERATURE
+                for heater in temperatures.values()
+                if isinstance(heater, dict))
             tool = temperatures.get('tool0')
             if tool:
                 head_text = f"{tool['actual']} / {tool['target']}\xb0C"
@@ -104,6 +191,15 @@ class PrinterInfoScreen(base.MicroPanelScreenBase):
 
         return c.image
 
+    def refresh_at(self, now):
+        """Follow the temperatures while a heater has a target, or is
+        still cooling down. Otherwise they only change along with the
+        printer's state, which fires events.
+        """
+        if self._changing:
+            return now + self.MAX_AGE
+        return None
+
     EVENTS = [
         Events.DISCONNECTED, Events.CONNECTED, Events.CONNECTING,
         Events.CONNECTIVITY_CHANGED, Events.DISCONNECTING,
@@ -171,6 +267,14 @@ class PrintStatusScreen(base.MicroPanelScreenBase):
             c.text((0, 18), "Waiting for file...")
 
         return c.image
+
+    def refresh_at(self, now):
+        """The print time is shown to the second while there is one.
+        """
+        if (self._printer.job['file']['name']
+            and self._printer.progress['printTime'] is not None):
+            return base.next_boundary(1, now)
+        return None
             
     EVENTS = [
         Events.DISCONNECTED, Events.CONNECTED, Events.CONNECTING,
@@ -178,6 +282,10 @@ class PrintStatusScreen(base.MicroPanelScreenBase):
         Events.Z_CHANGE, Events.PRINTER_STATE_CHANGED, Events.PRINT_FAILED,
         Events.PRINT_DONE, Events.PRINT_CANCELLED, Events.PRINT_CANCELLING,
         Events.PRINT_PAUSED, Events.PRINT_RESUMED,
+        # The selected job (and its filament estimate) can change while
+        # idle, with nothing else scheduling a redraw
+        Events.FILE_SELECTED, Events.FILE_DESELECTED, Events.UPLOAD,
+        Events.METADATA_ANALYSIS_FINISHED,
         "DisplayLayerProgress_heightChanged",
         "DisplayLayerProgress_layerChanged"
     ]
@@ -212,13 +320,20 @@ class PrintStatusScreen(base.MicroPanelScreenBase):
 class PrinterStatusBarScreen(base.MicroPanelScreenBase):
     """The common status bar, showing either printer state or job progress.
     """
+    # The longest time the ETA is shown without being redrawn. The
+    # estimated time left changes without any event being fired, so
+    # the ETA can move at any time.
+    ETA_REFRESH = 15
+
     def __init__(self, width, height, _printer, _settings):
         super().__init__(width, height)
         self._printer = _printer
         self._settings = _settings
+        self._progress = None
         
     def draw(self):
         c = self.get_canvas()
+        self._progress = None
         display_string = ""
         if self._printer.is_disconnected():
             display_string = "Printer Not Connected"
@@ -251,7 +366,9 @@ class PrinterStatusBarScreen(base.MicroPanelScreenBase):
         time_left = self._printer.progress['printTimeLeft'] or 0
 
         # Calculate progress from time
-        if self._settings.get_boolean(['timebased_progress']) and print_time:
+        timebased = (self._settings.get_boolean(['timebased_progress'])
+                     and print_time)
+        if timebased:
             percentage = (print_time * 100) / (print_time + time_left)
 
         # Progress bar
@@ -265,14 +382,46 @@ class PrinterStatusBarScreen(base.MicroPanelScreenBase):
                             time.localtime(time.time() + time_left))
         c.text_right(5, eta)
 
+        self._progress = (percentage, bar_width, time_left,
+                          print_time + time_left if timebased else None)
         return c.image
 
+    def refresh_at(self, now):
+        """Redraw when the ETA rolls over to the next value shown (or
+        after ETA_REFRESH seconds), or, for time based progress, when
+        the percentage or the progress bar would move.
+        """
+        if self._progress is None:
+            return None
+        percentage, bar_width, time_left, total_time = self._progress
+
+        # The ETA is shown in local time, so its boundaries are offset
+        # from UTC ones by the local time zone.
+        eta = now + time_left
+        resolution = strftime_resolution(
+            self._settings.get(["eta_strftime"], merged=True))
+        offset = -time.localtime(eta).tm_gmtoff
+        times = [base.next_boundary(resolution, eta, offset) - time_left,
+                 now + self.ETA_REFRESH]
+
+        if total_time:
+            # The progress moves by 1% every 1/100th of the total time
+            # and the percentage shown is rounded.
+            next_percentage = min(
+                math.floor(percentage + 0.5) + 0.5,
+                (bar_width + 1) * 100 / (self.width - 5))
+            times.append(now + max(
+                (next_percentage - percentage) * total_time / 100, 1))
+        return min(times)
+
     EVENTS = [
         Events.DISCONNECTED, Events.CONNECTED, Events.CONNECTING,
         Events.CONNECTIVITY_CHANGED, Events.DISCONNECTING,
         Events.Z_CHANGE, Events.PRINTER_STATE_CHANGED, Events.PRINT_FAILED,
         Events.PRINT_DONE, Events.PRINT_CANCELLED, Events.PRINT_CANCELLING,
         Events.PRINT_PAUSED, Events.PRINT_RESUMED,
+        # "Ready to Start" or "Waiting for Job" depends on the selected job
+        Events.FILE_SELECTED, Events.FILE_DESELECTED, Events.UPLOAD,
     ]
 
     def handle_event(self, event, payload):
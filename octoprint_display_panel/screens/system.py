@@ -1,62 +1,203 @@
 """System-centric Micro Panel screen.
 """
+import socket
+import threading
 import time
 import psutil
 import shutil
-import socket
+from collections import namedtuple
+from octoprint.util import monotonic_time
 
 from . import base
 
+import logging
+logger = logging.getLogger('octoprint.plugins.display_panel.screens.system')
+
+
+SystemStats = namedtuple('SystemStats', ['ip', 'load', 'memory', 'disk'])
+
+# The kernel's IPv4 routing table
+ROUTE_TABLE = '/proc/net/route'
+
+# Prefixes of the names of loopback, bridge and container interfaces,
+# whose addresses can't be used to reach OctoPrint from elsewhere
+VIRTUAL_INTERFACES = ('lo', 'docker', 'br-', 'veth', 'virbr')
+
+
+def default_route_interface():
+    """Return the name of the interface of the IPv4 default route, or
+    None if there is none (or it can't be told).
+    """
+    try:
+        with open(ROUTE_TABLE) as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    for line in lines:
+        fields = line.split()
+        # The route is up (RTF_UP) and its destination is 0.0.0.0
+        if len(fields) > 3 and fields[1] == '00000000' and int(fields[3], 16) & 1:
+            return fields[0]
+    return None
+
+
+class SystemStatsSampler:
+    """Collects system stats on a background thread.
+
+    The latest stats are published as an immutable SystemStats tuple
+    in `stats`, which can be read at any time without doing any I/O
+    (it is None until the first sample has been taken), along with the
+    time they were taken in `sampled_at`. Sampling only happens
+    between calls to `resume()` and `pause()`.
+
+    """
+    # Seconds between samples
+    INTERVAL = 5
+
+    # Seconds after which the IP address is looked up again, even if
+    # no network interface has changed (e.g. after a DHCP renewal)
+    ADDRESS_REFRESH = 60
+
+    def __init__(self, interval=INTERVAL):
+        self.interval = interval
+        self.stats = None
+        self.sampled_at = None
+        self._active = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._interfaces = None
+        self._ip = 'IP unavailable'
+        self._ip_checked = None
+
+    def resume(self):
+        """Start (or continue) sampling.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run,
+                                            name="DisplayPanelSystemStats",
+                                            daemon=True)
+            self._thread.start()
+        self._active.set()
+
+    def pause(self):
+        """Stop sampling until `resume()` is called.
+        """
+        self._active.clear()
+
+    def stop(self):
+        """Stop the sampling thread.
+        """
+        self._stopping.set()
+        self._active.set()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            if self._stopping.is_set():
+                return
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Failed to collect system stats")
+            if self._stopping.wait(self.interval):
+                return
+
+    def sample(self):
+        """Collect the system stats and publish them.
+        """
+        try:
+            load = psutil.getloadavg()
+        except OSError:
+            load = (-1, 0, 0)
+        self.stats = SystemStats(
+            ip=self.get_ip(),
+            load=load,
+            memory=psutil.virtual_memory(),
+            disk=shutil.disk_usage('/'),
+        )
+        self.sampled_at = time.time()
+
+    def get_ip(self):
+        """Return the IP address of the interface of the default route,
+        or else of the first other interface that is up.
+
+        Loopback, bridge and container interfaces are skipped. The
+        address is taken from local interface data, so it is also
+        available without external connectivity. It is only looked up
+        again when the interfaces that are up or the default route
+        change, or after ADDRESS_REFRESH seconds.
+
+        """
+        default = default_route_interface()
+        interfaces = tuple(name for name, stats in psutil.net_if_stats().items()
+                           if stats.isup and not name.startswith(VIRTUAL_INTERFACES))
+        if default in interfaces:
+            interfaces = (default,) + tuple(name for name in interfaces
+                                            if name != default)
+        now = monotonic_time()
+        if (interfaces == self._interfaces
+            and now - self._ip_checked < self.ADDRESS_REFRESH):
+            return self._ip
+        self._interfaces = interfaces
+        self._ip_checked = now
+
+        self._ip = 'IP unavailable'
+        addresses = psutil.net_if_addrs()
+        for name in interfaces:
+            for address in addresses.get(name, []):
+                if (address.family == socket.AF_INET
+                    and not address.address.startswith('127.')):
+                    self._ip = address.address
+                    return self._ip
+        return self._ip
+
 
 class SystemInfoScreen(base.MicroPanelScreenBase):
     """The common system information screen - IP, memory, etc.
     """
+    # Seconds to allow for a sample to be taken before redrawing
+    SAMPLE_MARGIN = 0.5
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.stats = {}
-        self.last_stats = 0
-        self.get_stats()
-        
+        self.sampler = SystemStatsSampler()
+
+    def set_visible(self, visible):
+        """Only sample the system stats while they can be seen.
+        """
+        super().set_visible(visible)
+        if visible:
+            self.sampler.resume()
+        else:
+            self.sampler.pause()
+
     def draw(self):
-        self.get_stats()
-        load = self.stats['load']
-        mem = self.stats['memory']
-        disk = self.stats['disk']
+        c = self.get_canvas()
+        stats = self.sampler.stats
+        if stats is None:
+            c.text_centered(0, "Gathering System Stats")
+            return c.image
+
+        load = stats.load
+        mem = stats.memory
+        disk = stats.disk
         disk_percent = (disk.used / disk.total) * 100.0
         MB = 1048576
         GB = MB * 1024
-        
-        c = self.get_canvas()
-        c.text_centered(0, self.stats['ip'])
+
+        c.text_centered(0, stats.ip)
         c.text((0, 9), f'L: {load[0]:.2f}, {load[1]:.2f}, {load[2]:.2f}')
         c.text((0, 18), (f'M: {mem.used//MB}/{mem.total//MB} MB'
                          f' {mem.percent}%'))
         c.text((0, 27), (f'D: {disk.used//GB}/{disk.total//GB} GB'
                          f' {disk_percent:.1f}%'))
         return c.image
-               
-    def get_stats(self):
-        # Only get stats every 5 seconds
-        if (time.time() - self.last_stats) < 5:
-            return
-        self.last_stats = time.time()
-        
-        try:
-            # This technique gives a reliable reading on the system's
-            # externally visible IP address, but requires that
-            # external connectivity is online.
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            self.stats['ip'] = s.getsockname()[0]
-            s.close()
-        except OSError:
-            self.stats['ip'] = 'IP unavailable'
-        
-        try:
-            self.stats['load'] = psutil.getloadavg()
-        except OSError:
-            self.stats['load'] = (-1, 0, 0)
-        self.stats['memory'] = psutil.virtual_memory()
-        self.stats['disk'] = shutil.disk_usage('/')
-        
-    
+
+    def refresh_at(self, now):
+        """Redraw once the sampler has published its next stats.
+        """
+        sampled_at = self.sampler.sampled_at
+        if sampled_at is None:
+            return now + self.SAMPLE_MARGIN
+        return max(sampled_at + self.sampler.interval + self.SAMPLE_MARGIN,
+                   now + self.SAMPLE_MARGIN)
@@ -22,6 +22,32 @@
         return this.base.simpleApiCommand("display_panel", "press", data, opts);
     };
 
+    // The "raw" variants return the frame as a packed 1-bit
+    // framebuffer instead of a PNG image
+    OctoPrintMicroPanelClient.prototype.getRaw = function (opts) {
+        return this.base.getWithQuery(
+            this.base.getSimpleApiUrl("display_panel"), {format: "raw"}, opts);
+    };
+
+    // Wait (up to timeout seconds) for a frame with a version other
+    // than since, then return the current frame in the raw format
+    OctoPrintMicroPanelClient.prototype.waitRaw = function (since, timeout, opts) {
+        var query = {format: "raw", since: since};
+        if (timeout !== undefined) {
+            query.timeout = timeout;
+        }
+        return this.base.getWithQuery(
+            this.base.getSimpleApiUrl("display_panel"), query, opts);
+    };
+
+    OctoPrintMicroPanelClient.prototype.pressRaw = function (label, opts) {
+        var data = {
+            button: label,
+            format: "raw"
+        };
+        return this.base.simpleApiCommand("display_panel", "press", data, opts);
+    };
+
     OctoPrintClient.registerPluginComponent(
         "display_panel",
         OctoPrintMicroPanelClient
@@ -4,16 +4,45 @@ $(function() {
 
 	self.settings = parameters[0];
 
-	self.currentImg = ko.observable();
+	self.currentVersion = null;
+	self.visible = false;
+	self.fallbackIntervalId = null;
 
 	// Retrieve the current image from the API
 	self.fetchImg = function () {
-	    OctoPrint.plugins.display_panel.get().done(self.fromResponse);
+	    OctoPrint.plugins.display_panel.getRaw().done(self.fromResponse);
 	}
 
-	// Handle the response from the API and set the current image
+	// Handle the response from the API and draw the current image
 	self.fromResponse = function(data) {
-	    self.currentImg(data.image_data);
+	    self.currentVersion = data.version;
+	    if (data.frame) {
+		self.drawFrame(data.width, data.height, data.frame);
+	    }
+	}
+
+	// Draw a packed 1-bit frame (rows MSB first, padded to whole
+	// bytes) onto the panel canvas
+	self.drawFrame = function(width, height, frame) {
+	    var canvas = document.getElementById("micropanel");
+	    if (canvas.width !== width || canvas.height !== height) {
+		canvas.width = width;
+		canvas.height = height;
+	    }
+	    var context = canvas.getContext("2d");
+	    var image = context.createImageData(width, height);
+	    var pixels = image.data;
+	    var bytes = atob(frame);
+	    var stride = Math.ceil(width / 8);
+	    for (var y = 0; y < height; y++) {
+		for (var x = 0; x < width; x++) {
+		    var bit = (bytes.charCodeAt(y * stride + (x >> 3)) >> (7 - (x & 7))) & 1;
+		    var i = (y * width + x) * 4;
+		    pixels[i] = pixels[i + 1] = pixels[i + 2] = bit ? 255 : 0;
+		    pixels[i + 3] = 255;
+		}
+	    }
+	    context.putImageData(image, 0, 0);
 	}
 
 	// Retrieve the current image once the page loads
@@ -21,6 +50,36 @@ $(function() {
 	    self.fetchImg();
 	}
 
+	// The plugin announces the version of each new frame over the
+	// socket; only fetch it if the panel is actually on screen
+	self.onDataUpdaterPluginMessage = function(plugin, data) {
+	    if (plugin !== "display_panel" || data.type !== "frame") {
+		return;
+	    }
+	    if (self.visible && data.version !== self.currentVersion) {
+		self.fetchImg();
+	    }
+	}
+
+	// Frames may have been missed while the socket was down
+	self.onDataUpdaterReconnect = function() {
+	    if (self.visible) {
+		self.fetchImg();
+	    }
+	}
+
+	// Called when the panel scrolls into or out of view. While it is
+	// visible, a slow poll serves as a fallback for missed messages.
+	self.setVisible = function(visible) {
+	    self.visible = visible;
+	    clearInterval(self.fallbackIntervalId);
+	    self.fallbackIntervalId = null;
+	    if (visible) {
+		self.fetchImg();
+		self.fallbackIntervalId = window.setInterval(self.fetchImg, 10000);
+	    }
+	}
+
 	// Refresh the current image (button handler)
 	self.btnRefresh = function() {
 	    self.fetchImg();
@@ -28,26 +87,66 @@ $(function() {
 
 	// Pass the other buttons to the API and update the image
 	self.btnMenu = function() {
-	    OctoPrint.plugins.display_panel.press('mode')
+	    OctoPrint.plugins.display_panel.pressRaw('mode')
 		.done(self.fromResponse);
 	}
 	self.btnCancel = function() {
-	    OctoPrint.plugins.display_panel.press('cancel')
+	    OctoPrint.plugins.display_panel.pressRaw('cancel')
 		.done(self.fromResponse);
 	}
 	self.btnPlay = function() {
-	    OctoPrint.plugins.display_panel.press('play')
+	    OctoPrint.plugins.display_panel.pressRaw('play')
 		.done(self.fromResponse);
 	}
 	self.btnPause = function() {
-	    OctoPrint.plugins.display_panel.press('pause')
+	    OctoPrint.plugins.display_panel.pressRaw('pause')
 		.done(self.fromResponse);
 	}
     }
 
+    function DisplayPanelSettingsViewModel(parameters) {
+	var self = this;
+
+	self.settingsViewModel = parameters[0];
+	self.settings = undefined;
+
+	// The hardware panel backends, of which only one can drive the
+	// display and its buttons
+	self.hardwareBackends = ["micro_panel", "spi_panel"];
+
+	// The settings are loaded by the time the dialog is bound; the
+	// display interface picks the hardware entry of panel_backends,
+	// leaving any other backends (such as the recording panel) alone
+	self.onBeforeBinding = function() {
+	    self.settings = self.settingsViewModel.settings;
+	    var backends = self.settings.plugins.display_panel.panel_backends;
+	    self.displayInterface = ko.pureComputed({
+		read: function() {
+		    return ko.utils.arrayFirst(backends(), function(name) {
+			return self.hardwareBackends.indexOf(name) !== -1;
+		    });
+		},
+		write: function(value) {
+		    var others = ko.utils.arrayFilter(backends(), function(name) {
+			return self.hardwareBackends.indexOf(name) === -1;
+		    });
+		    // The hardware panel comes first, as it sets the
+		    // dimensions of all the others
+		    backends([value].concat(others));
+		}
+	    });
+	}
+    }
+
     OCTOPRINT_VIEWMODELS.push([
 	MicroPanelViewModel,
 	[],
 	["#tab_plugin_display_panel"]
     ]);
+
+    OCTOPRINT_VIEWMODELS.push([
+	DisplayPanelSettingsViewModel,
+	["settingsViewModel"],
+	["#settings_plugin_display_panel"]
+    ]);
 });
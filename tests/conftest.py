@@ -0,0 +1,10 @@
+"""Run the tests against the stand-ins for the Raspberry Pi libraries
+and OctoPrint used by the benchmarks.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks', 'fakes'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+sys.path.insert(0, ROOT)
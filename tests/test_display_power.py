@@ -0,0 +1,30 @@
+"""Frames dropped while the display is off must not keep the display
+from being brought up to date when it wakes.
+"""
+from fixtures import make_plugin
+
+
+def test_frame_dropped_while_off_is_shown_on_wake():
+    plugin = make_plugin(panel_backends=['micro_panel', 'recording'])
+    micro, recording = plugin.disp.panels
+    plugin.render_ui()
+    shown = plugin.image.tobytes()
+
+    # The display goes off, and the frame rendered meanwhile is
+    # discarded by the output workers instead of being shown.
+    plugin.disp.poweroff()
+    plugin.top_screen.set_subscreen('print')
+    plugin.render_ui()
+    latest = plugin.image.tobytes()
+    assert latest != shown
+    assert all(stats['dropped'] for stats in plugin.disp.output_stats.values())
+
+    # Waking renders one fresh frame, identical to the one dropped,
+    # which still has to reach the panels.
+    plugin.disp.poweron()
+    assert recording.frames()[-1][1].tobytes() == shown
+    plugin.render_ui()
+
+    assert recording.frames()[-1][1].tobytes() == latest
+    assert micro._last_frame == micro.framebuffer()
+    assert micro.framebuffer() != bytes(len(micro.framebuffer()))
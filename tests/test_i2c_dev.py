@@ -0,0 +1,93 @@
+"""The direct I2C transport, writing to a fake bus device.
+"""
+import os
+
+import pytest
+from PIL import Image
+
+from fixtures import FakeSettings
+
+import octoprint_display_panel
+from octoprint_display_panel import panels
+from octoprint_display_panel.panels import i2c_dev, micro_panel
+
+
+class RecordedI2CDevPanel(micro_panel.MicroPanel):
+    """A Micro Panel whose bus is a fake device in a file.
+    """
+    device = None
+
+    def open_bus(self, settings):
+        return i2c_dev.FakeI2CDev(self.device)
+
+
+def make_settings(**settings):
+    defaults = octoprint_display_panel.Display_panelPlugin().get_settings_defaults()
+    return FakeSettings(defaults, **settings)
+
+
+@pytest.fixture
+def panel(tmp_path):
+    panel = RecordedI2CDevPanel(lambda *args: None)
+    panel.device = str(tmp_path / 'i2c-1')
+    panel.setup(make_settings(i2c_transport='i2c-dev'))
+    return panel
+
+
+def written(panel, since=0):
+    """Return the bytes written to the bus since the given offset.
+    """
+    with open(panel.device, 'rb') as f:
+        f.seek(since)
+        return f.read()
+
+
+def commands(*cmds):
+    return b''.join(bytes([0x80, cmd]) for cmd in cmds)
+
+
+def test_full_frame_is_one_write(panel):
+    img = Image.new('1', (128, 64))
+    img.putpixel((0, 0), 1)
+    panel.image(img)
+    panel._last_frame = None
+    offset = os.path.getsize(panel.device)
+    transactions = panel.i2c.transactions
+
+    panel.show()
+
+    # The window is set to the whole display, one command at a time,
+    # and the frame follows in a single write
+    frame = panel.framebuffer()
+    assert written(panel, offset) == (commands(0x21, 0, 127, 0x22, 0, 7)
+                                      + b'\x40' + frame)
+    assert panel.i2c.transactions - transactions == 7
+    assert frame[0] == 0x01
+
+
+def test_dirty_window_writes_only_its_range(panel):
+    offset = os.path.getsize(panel.device)
+    img = Image.new('1', (128, 64))
+    for x in range(40, 44):
+        img.putpixel((x, 25), 1)
+    panel.image(img)
+
+    panel.show()
+
+    # Page 3, columns 40 to 43, with row 25 in bit 1
+    assert written(panel, offset) == (commands(0x21, 40, 43, 0x22, 3, 3)
+                                      + b'\x40' + b'\x02' * 4)
+    assert panel.stats['windows'] == 1
+
+
+def test_missing_bus_device(tmp_path):
+    device = str(tmp_path / 'i2c-7')
+    settings = make_settings(i2c_transport='i2c-dev', i2c_device=device)
+
+    with pytest.raises(FileNotFoundError, match='i2c-7 does not exist'):
+        micro_panel.MicroPanel(lambda *args: None).setup(settings)
+
+    # The panel is left out, rather than set up halfway
+    settings.set(['panel_backends'], ['micro_panel'])
+    assert panels.Panels(settings, lambda *args: None).panels == []
+    assert not os.path.exists(device)
@@ -0,0 +1,64 @@
+"""The recording panel, and the API command that returns its frames.
+"""
+import base64
+from io import BytesIO
+
+import flask
+import pytest
+from PIL import Image
+from werkzeug.exceptions import BadRequest, NotFound
+
+from fixtures import make_plugin
+
+from octoprint_display_panel import panels
+from octoprint_display_panel.panels import recording_panel
+
+
+@pytest.fixture
+def app():
+    with flask.Flask(__name__).app_context():
+        yield
+
+
+def recording(plugin, **data):
+    return plugin.on_api_command('recording', data).get_json()
+
+
+@pytest.mark.parametrize('rotated', [False, True])
+def test_recorded_frames(app, rotated):
+    plugin = make_plugin(panel_backends=['recording'], image_rotate=rotated)
+    plugin.render_ui()
+    shown = plugin.image.rotate(180) if rotated else plugin.image
+
+    raw = recording(plugin, format='raw')
+    assert (raw['width'], raw['height']) == (128, 64)
+    assert base64.b64decode(raw['frames'][-1]['frame']) == shown.tobytes()
+
+    pbm = recording(plugin)
+    assert pbm['format'] == 'pbm'
+    image = Image.open(BytesIO(base64.b64decode(pbm['frames'][-1]['frame'])))
+    assert image.tobytes() == shown.tobytes()
+    assert len(pbm['frames']) == len(raw['frames'])
+
+
+def test_recording_errors(app):
+    plugin = make_plugin(panel_backends=['recording'])
+    with pytest.raises(BadRequest):
+        recording(plugin, format='gif')
+
+    plugin = make_plugin()
+    with pytest.raises(NotFound):
+        recording(plugin)
+
+
+def test_stats_by_backend_name(monkeypatch):
+    # A second backend sharing the recording panel's class
+    monkeypatch.setitem(panels.BACKENDS, 'recording_copy',
+                        recording_panel.RecordingPanel)
+    plugin = make_plugin(panel_backends=['recording', 'recording_copy'])
+    plugin.render_ui()
+
+    stats = plugin.disp.stats
+    assert set(stats) == set(plugin.disp.output_stats) == {
+        'recording', 'recording_copy'}
+    assert all(counters['frames'] == 1 for counters in stats.values())
@@ -0,0 +1,71 @@
+"""The Micro Panel display is rotated by the controller, through the
+segment remap (0xA0/0xA1) and COM output direction (0xC0/0xC8)
+commands.
+"""
+import busio
+import pytest
+
+from fixtures import make_plugin
+
+ORIENTATION_COMMANDS = {0xA0, 0xA1, 0xC0, 0xC8}
+
+
+@pytest.fixture
+def bus_log(monkeypatch):
+    log = []
+    monkeypatch.setattr(busio.I2C, 'log', log)
+    return log
+
+
+def orientation_commands(log):
+    """Return the orientation commands written to the bus, in order.
+    """
+    return [data[1] for address, data in log
+            if len(data) == 2 and data[0] == 0x80
+            and data[1] in ORIENTATION_COMMANDS]
+
+
+def micro_panel(plugin):
+    return plugin.disp.panels[0]
+
+
+def test_default_orientation(bus_log):
+    plugin = make_plugin(image_rotate=False)
+    assert orientation_commands(bus_log)[-2:] == [0xA1, 0xC8]
+    assert not micro_panel(plugin).rotated
+
+
+def test_rotated(bus_log):
+    plugin = make_plugin(image_rotate=True)
+    assert orientation_commands(bus_log)[-2:] == [0xA0, 0xC0]
+    assert micro_panel(plugin).rotated
+
+
+@pytest.mark.parametrize('rotated, expected', [
+    (True, [0xA0, 0xC0]),
+    (False, [0xA1, 0xC8]),
+])
+def test_rotation_changed_at_runtime(bus_log, rotated, expected):
+    plugin = make_plugin(image_rotate=not rotated)
+    del bus_log[:]
+
+    plugin._settings.set(['image_rotate'], rotated)
+    plugin.setup_display()
+
+    # The display is initialized again, in the driver's default
+    # orientation, before the rotation is applied
+    assert orientation_commands(bus_log)[-2:] == expected
+    assert micro_panel(plugin).rotated == rotated
+
+
+def test_rotation_sends_next_frame_in_full(bus_log):
+    plugin = make_plugin()
+    panel = micro_panel(plugin)
+    panel.image(plugin.top_screen.image)
+    panel.show()
+    full_frames = panel.stats['full_frames']
+
+    panel.set_rotation(True)
+    panel.show()
+
+    assert panel.stats['full_frames'] == full_frames + 1
@@ -0,0 +1,110 @@
+"""The SPI panel, writing to a fake SPI device that records every
+transfer.
+"""
+import pytest
+from PIL import Image
+
+import RPi.GPIO as GPIO
+from fixtures import FakeSettings
+
+import octoprint_display_panel
+from octoprint_display_panel.panels import spi_dev, spi_panel
+
+DC_PIN = 23
+
+
+class RecordedSPIPanel(spi_panel.SPIPanel):
+    """An SPI panel whose bus is a fake device in a file.
+    """
+    device = None
+
+    def open_bus(self, settings):
+        return spi_dev.FakeSPIDev(self.device, dc=self.set_dc)
+
+
+@pytest.fixture
+def dc_levels(monkeypatch):
+    levels = []
+
+    def output(channel, value):
+        if channel == DC_PIN:
+            levels.append(value)
+    monkeypatch.setattr(GPIO, 'output', output)
+    return levels
+
+
+def make_panel(tmp_path, controller='ssd1306'):
+    defaults = octoprint_display_panel.Display_panelPlugin().get_settings_defaults()
+    settings = FakeSettings(defaults, spi_controller=controller,
+                            spi_dc_pin=DC_PIN)
+    panel = RecordedSPIPanel(lambda *args: None)
+    panel.device = str(tmp_path / 'spidev')
+    panel.setup(settings)
+    return panel
+
+
+def transfers(panel):
+    return spi_dev.read_transfers(panel.device)
+
+
+def test_init_sequence_ssd1306(tmp_path, dc_levels):
+    panel = make_panel(tmp_path)
+    recorded = transfers(panel)
+
+    assert recorded[0] == (True, bytes(spi_panel.INIT_COMMANDS['ssd1306']))
+    # Default orientation, then a blank frame page by page, then on
+    assert recorded[1:3] == [(True, b'\xA1'), (True, b'\xC8')]
+    for page in range(8):
+        command, window = recorded[3 + 2 * page:5 + 2 * page]
+        assert command == (True, bytes([0xB0 | page, 0x00, 0x10]))
+        assert window == (False, bytes(128))
+    assert recorded[19:] == [(True, b'\xAF')]
+
+
+def test_init_sequence_sh1106(tmp_path, dc_levels):
+    panel = make_panel(tmp_path, 'sh1106')
+    recorded = transfers(panel)
+
+    assert recorded[0] == (True, bytes(spi_panel.INIT_COMMANDS['sh1106']))
+    # The 128 columns shown start at column 2 of the display RAM
+    for page in range(8):
+        assert recorded[3 + 2 * page] == (True, bytes([0xB0 | page, 0x02, 0x10]))
+
+
+@pytest.mark.parametrize('controller, low_column', [
+    ('ssd1306', 0x0A),
+    ('sh1106', 0x0C),
+])
+def test_only_dirty_pages_are_written(tmp_path, dc_levels, controller, low_column):
+    panel = make_panel(tmp_path, controller)
+    sent = len(transfers(panel))
+
+    img = Image.new('1', (128, 64))
+    img.putpixel((10, 25), 1)
+    panel.image(img)
+    panel.show()
+
+    # Only page 3, and in it only column 10, with row 25 in bit 1
+    assert transfers(panel)[sent:] == [
+        (True, bytes([0xB3, low_column, 0x10])),
+        (False, b'\x02'),
+    ]
+
+    sent = len(transfers(panel))
+    panel.show()
+    assert transfers(panel)[sent:] == []
+
+
+def test_dc_line_follows_commands_and_data(tmp_path, dc_levels):
+    panel = make_panel(tmp_path)
+    recorded = transfers(panel)
+
+    # The line is only set when the kind of transfer changes: low for
+    # commands, high for data.
+    kinds = [recorded[0][0]]
+    for command, data in recorded[1:]:
+        if command != kinds[-1]:
+            kinds.append(command)
+    assert dc_levels == [GPIO.HIGH if not command else GPIO.LOW
+                         for command in kinds]
+    assert dc_levels[:2] == [GPIO.LOW, GPIO.HIGH]